@@ -0,0 +1,240 @@
+"""
+    Actor/learner training: simulation and gradient updates run side by side.
+
+    Every actor process drives its own environment (a CoppeliaSim instance
+    per port, spaced PORT_STRIDE apart as in vector_env, or a surrogate) with
+    a local copy of the Q-network and adds its transitions to a
+    SharedReplayBuffer. The learner, the calling process, samples from that
+    buffer and trains continuously, publishes its weights to the actors
+    every PUBLISH_EVERY updates and refreshes the target network every
+    UPDATE_FREQ updates. Episodes are numbered globally, so epsilon decays
+    the same way as in train() whatever the number of actors.
+
+    python3 actor_learner.py --actors 2 --base-port 23000
+    python3 actor_learner.py --actors 4 --surrogate
+"""
+
+import argparse
+import multiprocessing
+import queue
+import random
+import traceback
+
+import numpy as np
+import torch
+from torch.nn.utils import parameters_to_vector, vector_to_parameters
+
+from exec_environment import (QLearningNetwork, Simulation, get_current_state, optimize, STATE_BITS,
+                              BUFFER_SIZE, BATCH_SIZE, UPDATE_FREQ, EPISODES, STEPS, REBUILD_ON_RESET,
+                              SERVER_STEP, SURROGATE, METRICS_FILE, CHECKPOINT_DIR, CHECKPOINT_EVERY,
+                              CHECKPOINT_KEEP, RESUME, LEARNING_RATE, EPSILON_DECAY)
+from replay_buffer import SharedReplayBuffer
+from policy_table import export_policy
+from metrics import MetricsWriter, truncate_metrics
+from checkpoint import save_checkpoint, load_checkpoint, latest_checkpoint
+from surrogate import SurrogateSimulation
+from vector_env import PORT_STRIDE, DONE_STATE
+
+ACTORS = 2
+PUBLISH_EVERY = 10
+# learner updates per transition added by the actors, None for no limit;
+# the synchronous loop in train() does one update per transition
+REPLAY_RATIO = 1.0
+
+
+class SharedWeights():
+    """Flat copy of a network's parameters in shared memory, with a version number."""
+
+    def __init__(self, network, ctx=None):
+        ctx = ctx or multiprocessing
+        numel = sum(p.numel() for p in network.parameters())
+        self.vector = ctx.Array('f', numel, lock=False)
+        self.version = ctx.Value('q', -1)
+
+    def publish(self, network):
+        flat = parameters_to_vector(network.parameters()).detach().numpy()
+        with self.version.get_lock():
+            np.frombuffer(self.vector, dtype=np.float32)[:] = flat
+            self.version.value += 1
+
+    def pull(self, network, version):
+        """Load newer weights into network; returns the version it now has."""
+        if self.version.value == version:
+            return version
+        with self.version.get_lock():
+            flat = np.frombuffer(self.vector, dtype=np.float32).copy()
+            version = self.version.value
+        vector_to_parameters(torch.from_numpy(flat), network.parameters())
+        return version
+
+
+def _actor(actor_id, sim_port, surrogate, server_step, replayBuffer, weights, nextEpisode, episodes, stop, results, seed):
+    env = None
+    try:
+        # the learner gets the cores, an actor only runs small forward passes
+        torch.set_num_threads(1)
+        random.seed(seed)
+        np.random.seed(seed)
+        if surrogate:
+            env = SurrogateSimulation(seed=seed)
+        else:
+            env = Simulation(sim_port=sim_port, server_step=server_step)
+        network = QLearningNetwork(env)
+        version = weights.pull(network, -1)
+        while not stop.is_set():
+            with nextEpisode.get_lock():
+                i = nextEpisode.value
+                if i >= episodes:
+                    break
+                nextEpisode.value += 1
+            epsilon = max(0.01, np.exp(-EPSILON_DECAY*i))
+            current_state, reward = get_current_state(env)
+            episode_reward = 0.0
+            for j in range(STEPS):
+                version = weights.pull(network, version)
+                if random.random() < epsilon:
+                    direction = np.random.choice(env.directions)
+                else:
+                    direction = env.getDirection(network.act(current_state))
+                env.action(direction)
+                new_state, reward = get_current_state(env)
+                replayBuffer.add(STATE_BITS[current_state], env.getDirectionNo(direction), reward, new_state == DONE_STATE, STATE_BITS[new_state])
+                current_state = new_state
+                episode_reward += reward
+                if new_state == DONE_STATE or stop.is_set():
+                    break
+            env.reset(rebuild=REBUILD_ON_RESET)
+            results.put(('episode', actor_id, (i, j+1, episode_reward, epsilon)))
+        env.stopSim()
+        results.put(('done', actor_id, None))
+    except Exception:
+        results.put(('error', actor_id, traceback.format_exc()))
+    finally:
+        replayBuffer.close()
+
+
+def train_actor_learner(actors=ACTORS, base_port=23000, surrogate=SURROGATE, server_step=SERVER_STEP,
+                        episodes=EPISODES, replay_ratio=REPLAY_RATIO, resume=RESUME):
+    """
+        Returns the number of learner updates. With a replay_ratio the
+        learner keeps training after the actors are done until it has made
+        replay_ratio updates per transition added in this run; without one
+        it stops with the actors.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    replayBuffer = SharedReplayBuffer(BUFFER_SIZE, ctx=ctx)
+    stop = ctx.Event()
+    processes = []
+    metrics = None
+    try:
+        Q_network = QLearningNetwork(None)
+        target_network = QLearningNetwork(None)
+        target_network.load_state_dict(Q_network.state_dict())
+        optimizer = torch.optim.Adam(Q_network.parameters(),lr=LEARNING_RATE)
+
+        start_episode = 0
+        checkpoint_path = latest_checkpoint(CHECKPOINT_DIR) if resume else None
+        if checkpoint_path:
+            last_episode, epsilon = load_checkpoint(checkpoint_path, Q_network, target_network, optimizer, replayBuffer)
+            start_episode = last_episode + 1
+            print(f'Resuming from {checkpoint_path} at episode {start_episode + 1}')
+            truncate_metrics(METRICS_FILE, start_episode)
+
+        weights = SharedWeights(Q_network, ctx)
+        weights.publish(Q_network)
+        nextEpisode = ctx.Value('q', start_episode)
+        results = ctx.Queue()
+        for actor_id in range(actors):
+            seed = random.randrange(2**32)
+            process = ctx.Process(target=_actor, daemon=True,
+                                  args=(actor_id, base_port + PORT_STRIDE * actor_id, surrogate, server_step, replayBuffer,
+                                        weights, nextEpisode, episodes, stop, results, seed))
+            process.start()
+            processes.append(process)
+
+        metrics = MetricsWriter(METRICS_FILE)
+        running = actors
+        finished = start_episode
+        latest = start_episode - 1
+        updates = 0
+        added = replayBuffer.added
+
+        def owed():
+            # updates still allowed by the replay ratio for the transitions added so far
+            if len(replayBuffer) < BATCH_SIZE:
+                return False
+            return replay_ratio is None or updates < (replayBuffer.added - added) * replay_ratio
+
+        def learn():
+            nonlocal updates
+            loss, td_errors = optimize(Q_network, target_network, optimizer, replayBuffer)
+            updates += 1
+            # the step of a learner update is its number, the episode the newest one started
+            metrics.logStep(episode=nextEpisode.value, step=updates, loss=loss, td_error=td_errors)
+            if updates % PUBLISH_EVERY == 0:
+                weights.publish(Q_network)
+            if updates % UPDATE_FREQ == 0:
+                target_network.load_state_dict(Q_network.state_dict())
+
+        while running:
+            ready = owed()
+            try:
+                # only wait for actor reports when there is nothing to learn from yet
+                kind, actor_id, value = results.get_nowait() if ready else results.get(timeout=0.01)
+            except queue.Empty:
+                kind = None
+                if not ready and not any(process.is_alive() for process in processes):
+                    raise RuntimeError('all actors exited without finishing')
+            if kind == 'error':
+                raise RuntimeError(f'actor {actor_id} failed:\n{value}')
+            if kind == 'done':
+                running -= 1
+            if kind == 'episode':
+                i, steps, episode_reward, epsilon = value
+                latest = max(latest, i)
+                finished += 1
+                metrics.logEpisode(episode=i+1, steps=steps, reward=episode_reward, epsilon=epsilon)
+                if finished % CHECKPOINT_EVERY == 0:
+                    metrics.flush()
+                    save_checkpoint(CHECKPOINT_DIR, latest, Q_network, target_network, optimizer, replayBuffer, epsilon, keep=CHECKPOINT_KEEP)
+            if ready:
+                learn()
+
+        # the actors are done; catch up on the updates the replay ratio still asks for
+        while replay_ratio is not None and owed():
+            learn()
+
+        torch.save(Q_network.state_dict(), "model")
+        export_policy(Q_network, "model_policy.npz")
+        return updates
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(timeout=60)
+            if process.is_alive():
+                process.terminate()
+        if metrics is not None:
+            metrics.close()
+        # unlinks the shared memory block, also when an actor or the learner failed
+        replayBuffer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train with actor processes and a learner running side by side.')
+    parser.add_argument('--actors', type=int, default=ACTORS)
+    parser.add_argument('--base-port', type=int, default=23000)
+    parser.add_argument('--surrogate', action='store_true', default=SURROGATE)
+    parser.add_argument('--server-step', action='store_true', default=SERVER_STEP,
+                        help='shake in the scene script; physics differ from client stepping (see envStep.lua)')
+    parser.add_argument('--episodes', type=int, default=EPISODES)
+    parser.add_argument('--replay-ratio', type=float, default=REPLAY_RATIO, help='updates per transition, 0 for no limit')
+    parser.add_argument('--resume', action='store_true', default=RESUME,
+                        help=f'continue from the newest checkpoint in {CHECKPOINT_DIR}')
+    args = parser.parse_args()
+    updates = train_actor_learner(args.actors, args.base_port, args.surrogate, args.server_step, args.episodes,
+                                  args.replay_ratio or None, args.resume)
+    print(f'{updates} learner updates')
+
+
+if __name__ == '__main__':
+    main()
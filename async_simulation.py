@@ -0,0 +1,155 @@
+"""
+    Asyncio version of Simulation built on zmqRemoteApi.asyncio.
+
+    One event loop can drive several simulators and overlap their requests:
+
+        async def episode(port):
+            async with AsyncSimulation(port) as env:
+                state, reward = await env.getCurrentState()
+                await env.action('Up')
+
+        async def main():
+            await asyncio.gather(episode(23000), episode(23002))
+
+        asyncio.run(main())
+"""
+
+import asyncio
+import sys
+import time
+
+from zmqRemoteApi.asyncio import RemoteAPIClient
+from state_engine import StateEngine, colour_labels
+
+STATE_ENGINE = StateEngine(grid=2)
+# polling interval while waiting for the simulation to stop, doubled up to the maximum
+POLL_MIN = 0.001
+POLL_MAX = 0.05
+STOP_TIMEOUT = 30.0
+
+
+class AsyncSimulation():
+    def __init__(self, sim_port = 23000):
+        self.sim_port = sim_port
+        self.directions = ['Up','Down','Left','Right']
+        self.client = RemoteAPIClient('localhost',port=self.sim_port)
+
+    async def __aenter__(self):
+        await self.client.__aenter__()
+        try:
+            await self.initializeSim()
+        except BaseException:
+            # __aexit__ is not called when __aenter__ fails, close the sockets here
+            await self.client.__aexit__(*sys.exc_info())
+            raise
+        return self
+
+    async def __aexit__(self, *excinfo):
+        try:
+            await self.stopSim()
+        finally:
+            await self.client.__aexit__(*excinfo)
+
+    async def initializeSim(self):
+        await self.client.setStepping(True)
+        self.sim = await self.client.getObject('sim')
+        self.defaultIdleFps = await self.sim.getInt32Param(self.sim.intparam_idle_fps)
+        await self.sim.setInt32Param(self.sim.intparam_idle_fps, 0)
+        self.tableHandle, self.boxHandle = await asyncio.gather(
+            self.sim.getObject('/Table'), self.sim.getObject('/Table/Box'))
+        await self.startScene()
+
+    async def startScene(self):
+        await self.sim.startSimulation()
+        await self.dropObjects()
+        await self.getObjectsInBoxHandles()
+        self.snapshot = await self.saveSnapshot()
+
+    async def dropObjects(self):
+        self.blocks = 18
+        frictionCube=0.06
+        frictionCup=0.8
+        blockLength=0.016
+        massOfBlock=14.375e-03
+        self.scriptHandle = await self.sim.getScript(self.sim.scripttype_childscript,self.tableHandle)
+        await self.client.step()
+        await self.sim.callScriptFunction('setNumberOfBlocks',self.scriptHandle,[self.blocks],[massOfBlock,blockLength,frictionCube,frictionCup],['cylinder'])
+        # wait until the blocks finish dropping, then let them settle for 20 steps
+        await self.client.stepUntil('toPython', 99, signalType='float', minSteps=1, extraSteps=20)
+
+    async def getObjectsInBoxHandles(self):
+        self.colours = colour_labels(self.blocks)
+        self.obj_type = "Cylinder"
+        self.object_shapes_handles = list(await asyncio.gather(
+            *(self.sim.getObjectHandle(f'{self.obj_type}{obj_idx}') for obj_idx in range(self.blocks))))
+
+    async def _gatherPoses(self, func, handles):
+        # all objects in one batched round trip, as in Simulation.getPositions
+        return await self.client.callMany([(func, [handle, self.sim.handle_world]) for handle in handles])
+
+    async def getPositions(self):
+        positions = await self._gatherPoses('sim.getObjectPosition', [self.boxHandle] + self.object_shapes_handles)
+        return positions[0], [list(position[:2]) for position in positions[1:]]
+
+    async def getObjectsPositions(self):
+        return (await self.getPositions())[1]
+
+    async def getBoxPosition(self):
+        return await self.sim.getObjectPosition(self.boxHandle,self.sim.handle_world)
+
+    async def getCurrentState(self):
+        box_position, positions = await self.getPositions()
+        state, reward, counts = STATE_ENGINE.evaluate(box_position, positions, self.colours)
+        return int(state), int(reward)
+
+    async def saveSnapshot(self):
+        handles = [self.boxHandle] + self.object_shapes_handles
+        positions, quaternions = await asyncio.gather(
+            self._gatherPoses('sim.getObjectPosition', handles),
+            self._gatherPoses('sim.getObjectQuaternion', handles))
+        return {'handles': handles, 'positions': positions, 'quaternions': quaternions}
+
+    async def restoreSnapshot(self, snapshot):
+        calls = []
+        for handle, position, quaternion in zip(snapshot['handles'], snapshot['positions'], snapshot['quaternions']):
+            calls.append(('sim.setObjectPosition', [handle, self.sim.handle_world, position]))
+            calls.append(('sim.setObjectQuaternion', [handle, self.sim.handle_world, quaternion]))
+            calls.append(('sim.resetDynamicObject', [handle]))
+        await self.client.callMany(calls)
+        await self.client.step()
+
+    async def reset(self, rebuild=False):
+        if rebuild:
+            await self.sim.stopSimulation()
+            await self.waitForState(self.sim.simulation_stopped)
+            await self.startScene()
+        else:
+            await self.restoreSnapshot(self.snapshot)
+
+    async def waitForState(self, state, timeout=STOP_TIMEOUT):
+        # stopping takes a few frames; poll quickly at first, then back off
+        deadline = time.monotonic() + timeout
+        delay = POLL_MIN
+        while await self.sim.getSimulationState() != state:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'simulation did not reach state {state} within {timeout}s')
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, POLL_MAX)
+
+    async def action(self,direction=None):
+        if direction not in self.directions:
+            print(f'Direction: {direction} invalid, please choose one from {self.directions}')
+            return
+        span = 0.02
+        steps = 5
+        idx = 1 if direction in ('Up', 'Down') else 0
+        dirs = [1, -1] if direction in ('Up', 'Right') else [-1, 1]
+        box_position = await self.getBoxPosition()
+        for _dir in dirs:
+            for _ in range(steps):
+                box_position[idx] += _dir*span / steps
+                await self.sim.setObjectPosition(self.boxHandle, self.sim.handle_world, box_position)
+                await self.client.step()
+
+    async def stopSim(self):
+        await self.sim.stopSimulation()
@@ -0,0 +1,161 @@
+"""
+    Benchmarks for the environment and training hot paths.
+
+    Against the local stand-in server (no simulator needed):
+    python3 benchmark.py --backend mock --latency 0.0002
+    python3 benchmark.py --backend mock --codec cbor2-typed
+
+    Against a running CoppeliaSim:
+    python3 benchmark.py --backend live --port 23000
+
+    Results can be stored as a baseline and later runs compared against it:
+    python3 benchmark.py --save-baseline benchmark_baseline.json
+    python3 benchmark.py --compare benchmark_baseline.json
+
+    Results are keyed by operation; how they were measured (backend, codec,
+    ...) is stored under 'metadata' and differences are reported on compare.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from exec_environment import (Simulation, QLearningNetwork, get_current_state, optimize,
+                              STATE_BITS, BATCH_SIZE, BUFFER_SIZE, STEPS)
+from replay_buffer import ReplayBuffer
+
+PERCENTILES = (50, 90, 99)
+
+
+def measure(func, repeat, warmup=3):
+    """Call func repeat times and return the durations in seconds."""
+    for _ in range(warmup):
+        func()
+    durations = np.empty(repeat)
+    for k in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations[k] = time.perf_counter() - start
+    return durations
+
+
+def summarize(durations):
+    summary = {f'p{p}': float(np.percentile(durations, p)) for p in PERCENTILES}
+    summary['mean'] = float(durations.mean())
+    summary['per_second'] = float(1.0 / durations.mean())
+    return summary
+
+
+def run_benchmarks(port, repeat, episodes, server_step=False):
+    results = {}
+    directions = ['Up','Down','Left','Right']
+
+    env = Simulation(sim_port=port, server_step=server_step)
+    client = env.client
+    results['metadata'] = {'codec': client.codec.name + ('-typed' if getattr(client.codec, 'typedArrays', False) else '')}
+    results['call'] = summarize(measure(lambda: client.call('sim.getSimulationTime', []), repeat))
+    results['client.step'] = summarize(measure(client.step, repeat))
+    results['client.step(20)'] = summarize(measure(lambda: client.step(20), repeat))
+    # one stepUntil request only against a server implementing it (the stand-in), else 20 step requests
+    results['metadata']['multi_step'] = 'stepUntil' if client.stepUntilSupported else 'step loop'
+    results['Simulation.action'] = summarize(measure(lambda: env.action(np.random.choice(directions)), repeat))
+    results['get_current_state'] = summarize(measure(lambda: get_current_state(env), repeat))
+    results['Simulation.reset'] = summarize(measure(env.reset, repeat))
+    env.stopSim()
+
+    def build():
+        Simulation(sim_port=port, server_step=server_step).stopSim()
+    results['episode construction'] = summarize(measure(build, episodes, warmup=1))
+
+    replayBuffer = ReplayBuffer(BUFFER_SIZE)
+    for _ in range(BUFFER_SIZE):
+        state, new_state = np.random.randint(16, size=2)
+        replayBuffer.add(STATE_BITS[state], np.random.randint(4), 0, False, STATE_BITS[new_state])
+    results['replay sample'] = summarize(measure(lambda: replayBuffer.sample(BATCH_SIZE), repeat))
+
+    Q_network = QLearningNetwork(None)
+    target_network = QLearningNetwork(None)
+    optimizer = torch.optim.Adam(Q_network.parameters(), lr=0.40)
+    results['optimizer update'] = summarize(measure(lambda: optimize(Q_network, target_network, optimizer, replayBuffer), repeat))
+
+    # one training step is an action, a state read and an update
+    step = results['Simulation.action']['mean'] + results['get_current_state']['mean'] + results['optimizer update']['mean']
+    episode = results['Simulation.reset']['mean'] + STEPS * step
+    results['throughput'] = {'steps_per_second': 1.0 / step, 'episodes_per_hour': 3600.0 / episode}
+    return results
+
+
+def report(results, baseline=None, tolerance=0.1):
+    """Print the results; with a baseline, flag means more than tolerance slower."""
+    regressions = []
+    if baseline:
+        measured = [name for name in results if name not in ('metadata', 'throughput')]
+        if not any(name in baseline for name in measured):
+            raise SystemExit(f'the baseline has none of the measured operations: {", ".join(measured)}')
+        for key, value in results['metadata'].items():
+            if baseline.get('metadata', {}).get(key) != value:
+                print(f'note: {key} is {value!r}, the baseline used {baseline.get("metadata", {}).get(key)!r}')
+    for name, summary in results.items():
+        if name in ('metadata', 'throughput'):
+            continue
+        line = f'{name:22s} ' + ' '.join(f'p{p}={summary[f"p{p}"] * 1e3:8.3f}ms' for p in PERCENTILES)
+        line += f' {summary["per_second"]:10.1f}/s'
+        if baseline and name in baseline:
+            ratio = summary['mean'] / baseline[name]['mean']
+            line += f'  x{ratio:.2f} vs baseline'
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+    throughput = results['throughput']
+    print(f'{throughput["steps_per_second"]:.1f} training steps/s, {throughput["episodes_per_hour"]:.0f} episodes/hour')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the environment and training hot paths.')
+    parser.add_argument('--backend', choices=['mock', 'live'], default='mock')
+    parser.add_argument('--port', type=int, default=23000)
+    parser.add_argument('--latency', type=float, default=0.0, help='mock server delay per reply, in seconds')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--episodes', type=int, default=5, help='repetitions of the full episode construction')
+    parser.add_argument('--server-step', action='store_true',
+                        help='shake in the scene script; faster, but physics differ from client stepping (see envStep.lua)')
+    parser.add_argument('--codec', help='message codec of the client and the mock server, see zmqRemoteApi/codec.py')
+    parser.add_argument('--save-baseline')
+    parser.add_argument('--compare')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.codec:
+        # read by both the mock server and the clients Simulation creates
+        os.environ['ZMQREMOTEAPI_CODEC'] = args.codec
+    server = None
+    if args.backend == 'mock':
+        from zmqRemoteApi.server import RemoteAPIServer
+        server = RemoteAPIServer(port=args.port, latency=args.latency).start()
+    try:
+        results = run_benchmarks(args.port, args.repeat, args.episodes, server_step=args.server_step)
+    finally:
+        if server is not None:
+            server.stop()
+    results['metadata'].update(backend=args.backend, latency=args.latency if server else None, server_step=args.server_step)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.tolerance)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        raise SystemExit(f'slower than baseline: {", ".join(regressions)}')
+
+
+if __name__ == '__main__':
+    main()
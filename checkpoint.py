@@ -0,0 +1,79 @@
+"""
+    Periodic training checkpoints.
+
+    A checkpoint holds everything needed to continue a run: both networks,
+    the optimizer, the replay buffer, the episode index, epsilon and the
+    Python, NumPy and torch RNG states. Files are written to a temporary name
+    and renamed into place, so a crash never leaves a truncated checkpoint,
+    and only the newest few are kept.
+"""
+
+import glob
+import os
+import random
+import re
+import tempfile
+
+import numpy as np
+import torch
+
+CHECKPOINT_PATTERN = re.compile(r'checkpoint-(\d+)\.pt$')
+
+
+def _checkpoints(directory):
+    # (episode, path) pairs, oldest first
+    found = []
+    for path in glob.glob(os.path.join(glob.escape(directory), 'checkpoint-*.pt')):
+        match = CHECKPOINT_PATTERN.search(os.path.basename(path))
+        if match:
+            found.append((int(match.group(1)), path))
+    return sorted(found)
+
+
+def latest_checkpoint(directory):
+    """Path of the newest checkpoint in directory, or None."""
+    found = _checkpoints(directory)
+    return found[-1][1] if found else None
+
+
+def save_checkpoint(directory, episode, Q_network, target_network, optimizer, replayBuffer, epsilon, keep=3):
+    """Atomically write the checkpoint for a finished episode and prune old ones."""
+    os.makedirs(directory, exist_ok=True)
+    state = {
+        'episode': episode,
+        'epsilon': epsilon,
+        'Q_network': Q_network.state_dict(),
+        'target_network': target_network.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'replay_buffer': replayBuffer.state_dict(),
+        'rng': {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()},
+    }
+    path = os.path.join(directory, f'checkpoint-{episode:06d}.pt')
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    if keep:
+        for _, old in _checkpoints(directory)[:-keep]:
+            os.remove(old)
+    return path
+
+
+def load_checkpoint(path, Q_network, target_network, optimizer, replayBuffer):
+    """Restore a checkpoint in place; returns its episode index and epsilon."""
+    # checkpoints hold NumPy arrays and RNG tuples, which weights_only rejects
+    state = torch.load(path, weights_only=False)
+    Q_network.load_state_dict(state['Q_network'])
+    target_network.load_state_dict(state['target_network'])
+    optimizer.load_state_dict(state['optimizer'])
+    replayBuffer.load_state_dict(state['replay_buffer'])
+    random.setstate(state['rng']['python'])
+    np.random.set_state(state['rng']['numpy'])
+    torch.set_rng_state(state['rng']['torch'])
+    return state['episode'], state['epsilon']
@@ -0,0 +1,37 @@
+-- Installed into the Table child script by Simulation(server_step=True).
+-- Runs a whole shake of the box and returns the final box and block
+-- positions, so one environment step costs a single remote call.
+--
+-- The shake runs inside one script call, so it cannot go through the main
+-- simulation loop: every increment is advanced with sim.handleDynamics
+-- alone. Simulation time does not move, and other scripts, sensors and
+-- joint controllers do not run while the box is shaken. The dynamics
+-- therefore differ from the client stepped action, which is the default;
+-- results obtained with server_step=True are not comparable to it.
+--
+-- inInts:   {axis (0 = x, 1 = y), box handle, block handles...}
+-- inFloats: {span, increments per stroke, stroke directions...}
+-- returns:  {}, {box x, y, z, block1 x, y, z, ...}, {}, ''
+function envStep(inInts,inFloats,inStrings,inBuffer)
+    local axis=inInts[1]+1
+    local boxHandle=inInts[2]
+    local span=inFloats[1]
+    local steps=math.floor(inFloats[2])
+    local dt=sim.getSimulationTimeStep()
+    local pos=sim.getObjectPosition(boxHandle,sim.handle_world)
+    for i=3,#inFloats do
+        for s=1,steps do
+            pos[axis]=pos[axis]+inFloats[i]*span/steps
+            sim.setObjectPosition(boxHandle,sim.handle_world,pos)
+            sim.handleDynamics(dt)
+        end
+    end
+    local out={}
+    for i=2,#inInts do
+        local p=sim.getObjectPosition(inInts[i],sim.handle_world)
+        out[#out+1]=p[1]
+        out[#out+1]=p[2]
+        out[#out+1]=p[3]
+    end
+    return {},out,{},''
+end
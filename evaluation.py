@@ -0,0 +1,353 @@
+"""
+    Evaluate saved policies on several simulators at once.
+
+    Episodes are spread over one worker process per simulator port (or per
+    surrogate scene) and run greedily like test.py: at most STEPS actions,
+    stopping as soon as the state reaches 15. Every episode after a worker's
+    first drops the blocks again (reset(rebuild=True)), so episodes start from
+    independent scenes and evaluation of a model can stop early once the
+    Wilson confidence interval of its success rate is within the tolerance.
+    With --no-rebuild episodes restart from the same snapshot, are correlated,
+    and always run to max_episodes. Results are cached by the SHA-256 of the
+    model file and the evaluation settings, so unchanged models are not
+    evaluated again.
+
+    python3 evaluation.py model modelFirstThousand --ports 23000 23002 23004
+    python3 evaluation.py checkpoints/*.pt --surrogate --workers 4
+
+    A model is a saved state dict (see model_loader), a checkpoint written by
+    checkpoint.py or an .npz policy table.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import statistics
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+from vector_env import CLOSE_TIMEOUT, DONE_STATE
+
+STEPS = 30
+MAX_EPISODES = 100
+MIN_EPISODES = 20
+CONFIDENCE = 0.95
+TOLERANCE = 0.05
+# drop the blocks again for every episode; restoring the snapshot gives correlated episodes
+REBUILD = True
+# surrogate worker i drops its scenes with seed SEED + i
+SEED = 0
+CACHE_FILE = 'evaluation_cache.json'
+
+
+def load_policy(path):
+    """Policy with act(state) for a state dict, a training checkpoint or an .npz table."""
+    if path.endswith('.npz'):
+        from policy_table import TablePolicy
+        return TablePolicy(path)
+    import torch
+    from model_loader import load_model
+    try:
+        return load_model(path)
+    except Exception:
+        # training checkpoints also hold the optimizer, replay buffer and RNG states
+        state = torch.load(path, weights_only=False, map_location='cpu')
+        if not isinstance(state, dict) or 'Q_network' not in state:
+            raise
+        from exec_environment import QLearningNetwork
+        network = QLearningNetwork(None)
+        network.load_state_dict(state['Q_network'])
+        return network.eval()
+
+
+def run_episode(env, policy, steps=STEPS):
+    """One greedy episode; returns (solved, actions taken, total reward)."""
+    from exec_environment import get_current_state
+    state, reward = get_current_state(env)
+    total_reward = 0.0
+    for step in range(steps):
+        if state == DONE_STATE:
+            return True, step, total_reward
+        env.action(env.getDirection(policy.act(state)))
+        state, reward = get_current_state(env)
+        total_reward += reward
+    return state == DONE_STATE, steps, total_reward
+
+
+def _worker(conn, sim_port, surrogate, seed, steps, rebuild):
+    import torch
+    torch.set_num_threads(1)
+    from exec_environment import Simulation
+    from surrogate import SurrogateSimulation
+    env = None
+    try:
+        env = SurrogateSimulation(seed=seed) if surrogate else Simulation(sim_port=sim_port)
+        policy = None
+        fresh = True
+        conn.send(('ok', None))
+        while True:
+            cmd, arg = conn.recv()
+            if cmd == 'load':
+                policy = load_policy(arg)
+                conn.send(('ok', None))
+            elif cmd == 'episode':
+                # the first episode starts from the scene as built
+                if not fresh:
+                    env.reset(rebuild=rebuild)
+                fresh = False
+                conn.send(('ok', run_episode(env, policy, steps)))
+            elif cmd == 'close':
+                env.stopSim()
+                conn.send(('ok', None))
+                break
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def wilson_interval(successes, n, confidence=CONFIDENCE):
+    """Wilson score interval of a success rate."""
+    if n == 0:
+        return 0.0, 1.0
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def summarize(results, confidence=CONFIDENCE):
+    solved = np.array([r[0] for r in results], dtype=bool)
+    steps = np.array([r[1] for r in results])
+    rewards = np.array([r[2] for r in results], dtype=float)
+    low, high = wilson_interval(int(solved.sum()), len(results), confidence)
+    solve_steps = steps[solved]
+    summary = {
+        'episodes': len(results),
+        'successes': int(solved.sum()),
+        'success_rate': float(solved.mean()) if len(results) else 0.0,
+        'confidence_interval': [low, high],
+        'reward': {'mean': float(rewards.mean()), 'std': float(rewards.std())} if len(results) else {},
+        'steps_to_solve': {},
+    }
+    if len(solve_steps):
+        values, counts = np.unique(solve_steps, return_counts=True)
+        summary['steps_to_solve'] = {
+            'mean': float(solve_steps.mean()), 'p50': float(np.percentile(solve_steps, 50)),
+            'p90': float(np.percentile(solve_steps, 90)), 'max': int(solve_steps.max()),
+            'histogram': {str(v): int(c) for v, c in zip(values, counts)},
+        }
+    return summary
+
+
+def model_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache():
+    """Evaluation summaries in a JSON file, keyed by model hash and settings."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, summary):
+        self.entries[key] = summary
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+class Evaluator():
+    def __init__(self, ports=(23000,), surrogate=False, workers=None, steps=STEPS, max_episodes=MAX_EPISODES,
+                 min_episodes=MIN_EPISODES, confidence=CONFIDENCE, tolerance=TOLERANCE, cache_file=CACHE_FILE,
+                 rebuild=REBUILD, seed=SEED):
+        """
+            One worker per port, or workers surrogate scenes. The run for a
+            model stops after max_episodes or, when rebuilding the scene for
+            every episode, once at least min_episodes are done and the
+            confidence interval is at most 2 * tolerance wide.
+        """
+        self.steps = steps
+        self.max_episodes = max_episodes
+        self.min_episodes = min_episodes
+        self.confidence = confidence
+        self.tolerance = tolerance
+        self.ports = ports
+        self.surrogate = surrogate
+        self.workers = (workers or os.cpu_count()) if surrogate else len(ports)
+        self.rebuild = rebuild
+        self.seed = seed
+        self.backend = 'surrogate' if surrogate else 'coppeliasim'
+        self.cache = ResultCache(cache_file) if cache_file else None
+        self.conns = []
+        self.processes = []
+
+    def _start(self):
+        # started with the first model that is not cached
+        ctx = multiprocessing.get_context('spawn')
+        for i in range(self.workers):
+            parent, child = ctx.Pipe()
+            port = None if self.surrogate else self.ports[i]
+            process = ctx.Process(target=_worker, args=(child, port, self.surrogate, self.seed + i, self.steps, self.rebuild),
+                                  daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+        for conn in self.conns:
+            self._result(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def _result(self, conn):
+        status, value = conn.recv()
+        if status == 'error':
+            raise RuntimeError(f'evaluation worker failed:\n{value}')
+        return value
+
+    def settings(self):
+        return {'backend': self.backend, 'workers': self.workers, 'seed': self.seed, 'rebuild': self.rebuild,
+                'steps': self.steps, 'max_episodes': self.max_episodes, 'min_episodes': self.min_episodes,
+                'confidence': self.confidence, 'tolerance': self.tolerance}
+
+    def _done(self, results):
+        if len(results) >= self.max_episodes:
+            return True
+        # episodes restarted from one snapshot are not independent samples
+        if not self.rebuild or len(results) < self.min_episodes:
+            return False
+        low, high = wilson_interval(sum(r[0] for r in results), len(results), self.confidence)
+        return high - low <= 2 * self.tolerance
+
+    def evaluate(self, path):
+        """Summary of the model at path, from the cache when it was evaluated before."""
+        settings = self.settings()
+        key = model_hash(path) + ':' + json.dumps(settings, sort_keys=True)
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            return dict(cached, model=path, cached=True)
+
+        start = time.perf_counter()
+        if not self.conns:
+            self._start()
+        for conn in self.conns:
+            conn.send(('load', path))
+        for conn in self.conns:
+            self._result(conn)
+        results = []
+        busy = set()
+        for conn in self.conns:
+            conn.send(('episode', None))
+            busy.add(conn)
+        while busy:
+            for conn in multiprocessing.connection.wait(busy):
+                results.append(self._result(conn))
+                busy.discard(conn)
+                # episodes already running are kept, no new ones once done
+                if not self._done(results) and len(results) + len(busy) < self.max_episodes:
+                    conn.send(('episode', None))
+                    busy.add(conn)
+        summary = summarize(results, self.confidence)
+        summary.update(settings=settings, stopped_early=len(results) < self.max_episodes,
+                       seconds=time.perf_counter() - start)
+        if self.cache:
+            self.cache.put(key, summary)
+        return dict(summary, model=path, cached=False)
+
+    def close(self):
+        # workers that already died, e.g. after an error, are only reaped
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(('close', None))
+                except (BrokenPipeError, EOFError, OSError):
+                    pass
+        for conn, process in zip(self.conns, self.processes):
+            try:
+                if process.is_alive() and conn.poll(CLOSE_TIMEOUT):
+                    conn.recv()
+            except (EOFError, OSError):
+                pass
+            process.join(timeout=CLOSE_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            conn.close()
+        self.conns = []
+        self.processes = []
+
+
+def report(summary):
+    low, high = summary['confidence_interval']
+    line = (f'{summary["model"]}: {summary["successes"]}/{summary["episodes"]} solved '
+            f'({summary["success_rate"]:.1%}, {summary["settings"]["confidence"]:.0%} CI {low:.1%}-{high:.1%})')
+    solve = summary['steps_to_solve']
+    if solve:
+        line += f', steps to solve p50={solve["p50"]:.0f} p90={solve["p90"]:.0f} max={solve["max"]}'
+    if summary['reward']:
+        line += f', reward {summary["reward"]["mean"]:.2f}±{summary["reward"]["std"]:.2f}'
+    line += ' (cached)' if summary['cached'] else f' in {summary["seconds"]:.1f}s'
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate saved policies on several simulators in parallel.')
+    parser.add_argument('models', nargs='+')
+    parser.add_argument('--ports', type=int, nargs='+', default=[23000])
+    parser.add_argument('--surrogate', action='store_true', help='evaluate on surrogate scenes instead of CoppeliaSim')
+    parser.add_argument('--workers', type=int, help='surrogate worker processes, default one per CPU')
+    parser.add_argument('--steps', type=int, default=STEPS)
+    parser.add_argument('--max-episodes', type=int, default=MAX_EPISODES)
+    parser.add_argument('--min-episodes', type=int, default=MIN_EPISODES)
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='half width of the confidence interval to stop at')
+    parser.add_argument('--no-rebuild', dest='rebuild', action='store_false',
+                        help='restart episodes from the first scene instead of dropping the blocks again; disables the early stop')
+    parser.add_argument('--seed', type=int, default=SEED, help='seed of the first surrogate worker')
+    parser.add_argument('--cache', default=CACHE_FILE, help='result cache file, empty to disable')
+    parser.add_argument('--json', help='also write the summaries to this file')
+    args = parser.parse_args()
+
+    with Evaluator(args.ports, args.surrogate, args.workers, args.steps, args.max_episodes, args.min_episodes,
+                   args.confidence, args.tolerance, args.cache, args.rebuild, args.seed) as evaluator:
+        summaries = []
+        for path in args.models:
+            summary = evaluator.evaluate(path)
+            report(summary)
+            summaries.append(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summaries, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,8 +12,18 @@ import random
 import sys
 # Change to the path of your ZMQ python API
 sys.path.append('/app/zmq/')
+import argparse
 import numpy as np
 from zmqRemoteApi import RemoteAPIClient
+from zmqRemoteApi.stepping import unknownFunction
+from state_engine import StateEngine, colour_labels
+from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from policy_table import export_policy
+from metrics import MetricsWriter, truncate_metrics
+from checkpoint import save_checkpoint, load_checkpoint, latest_checkpoint
+from surrogate import SurrogateBatch, SurrogateSimulation
+from trajectories import TrajectoryRecorder
+from vector_env import VectorSimulation, select_directions
 import time
 import torch
 import torch.nn as nn
@@ -21,16 +31,27 @@ import torch.optim as optim
 from collections import deque
 import itertools
 import torch.nn.functional as F
+import os
 
 
 # from keras import Model
 # from keras.layers import Dense
 # from keras.optimizers import Adam
 
+# seconds reset(rebuild=True) waits for the simulation to stop
+STOP_TIMEOUT = 30.0
+ENV_STEP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'envStep.lua')
+
 class Simulation():
-    def __init__(self, sim_port = 23000):
+    def __init__(self, sim_port = 23000, server_step = False):
+        # server_step runs each action inside the Table child script (see
+        # envStep.lua) and returns the resulting positions in the same reply.
+        # It advances physics outside the main simulation loop, so the
+        # dynamics differ from the default client stepped actions.
         self.sim_port = sim_port
+        self.server_step = server_step
         self.directions = ['Up','Down','Left','Right']
+        self.lastPositions = None
         self.initializeSim()
 
     def initializeSim(self):
@@ -45,9 +66,58 @@ class Simulation():
         self.sim.setInt32Param(self.sim.intparam_idle_fps, 0)  
         
         self.getObjectHandles()
+        self.startScene()
+
+    def startScene(self):
         self.sim.startSimulation()
         self.dropObjects()
         self.getObjectsInBoxHandles()
+        self.snapshot = self.saveSnapshot()
+        if self.server_step:
+            self.installEnvStep()
+
+    def installEnvStep(self):
+        try:
+            with open(ENV_STEP_SCRIPT) as f:
+                self.sim.executeScriptString(f.read(), self.scriptHandle)
+        except Exception as e:
+            print(f'Could not install envStep ({e}), stepping from the client instead')
+            self.server_step = False
+
+    def reset(self, rebuild=False):
+        # Start a new episode on the same connection. By default the blocks are
+        # put back where they settled after the first drop; with rebuild=True
+        # the simulation is restarted and the blocks are dropped again.
+        self.lastPositions = None
+        if rebuild:
+            self.sim.stopSimulation()
+            deadline = time.monotonic() + STOP_TIMEOUT
+            while self.sim.getSimulationState() != self.sim.simulation_stopped:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'simulation did not stop within {STOP_TIMEOUT}s')
+                time.sleep(0.01)
+            self.startScene()
+        else:
+            self.restoreSnapshot(self.snapshot)
+
+    def saveSnapshot(self):
+        handles = [self.boxHandle] + self.object_shapes_handles
+        calls = []
+        for handle in handles:
+            calls.append(('sim.getObjectPosition', [handle, self.sim.handle_world]))
+            calls.append(('sim.getObjectQuaternion', [handle, self.sim.handle_world]))
+        poses = self.client.callMany(calls)
+        return {'handles': handles, 'positions': poses[0::2], 'quaternions': poses[1::2]}
+
+    def restoreSnapshot(self, snapshot):
+        calls = []
+        for handle, position, quaternion in zip(snapshot['handles'], snapshot['positions'], snapshot['quaternions']):
+            calls.append(('sim.setObjectPosition', [handle, self.sim.handle_world, position]))
+            calls.append(('sim.setObjectQuaternion', [handle, self.sim.handle_world, quaternion]))
+            # drop the velocities the blocks had at the end of the last episode
+            calls.append(('sim.resetDynamicObject', [handle]))
+        self.client.callMany(calls)
+        self.client.step()
     
     def getObjectHandles(self):
         self.tableHandle=self.sim.getObject('/Table')
@@ -64,16 +134,8 @@ class Simulation():
         self.client.step()
         retInts,retFloats,retStrings=self.sim.callScriptFunction('setNumberOfBlocks',self.scriptHandle,[self.blocks],[massOfBlock,blockLength,frictionCube,frictionCup],['cylinder'])
         
-        #print('Wait until blocks finish dropping')
-        while True:
-            self.client.step()
-            signalValue=self.sim.getFloatSignal('toPython')
-            if signalValue == 99:
-                loop = 20
-                while loop > 0:
-                    self.client.step()
-                    loop -= 1
-                break
+        #print('Wait until blocks finish dropping, then let them settle for 20 steps')
+        self.client.stepUntil('toPython', 99, signalType='float', minSteps=1, extraSteps=20)
 
     # def test_agent():
     #     load the q table
@@ -83,6 +145,7 @@ class Simulation():
     
     
     def getObjectsInBoxHandles(self):
+        self.colours = colour_labels(self.blocks)
         self.object_shapes_handles=[]
         self.obj_type = "Cylinder"
         for obj_idx in range(self.blocks):
@@ -90,14 +153,19 @@ class Simulation():
             self.object_shapes_handles.append(obj_handle)
 
     def getObjectsPositions(self):
-        pos_step = []
-        box_position = self.sim.getObjectPosition(self.boxHandle,self.sim.handle_world)
-        for obj_handle in self.object_shapes_handles:
-            # get the starting position of source
-            obj_position = self.sim.getObjectPosition(obj_handle,self.sim.handle_world)
-            obj_position = np.array(obj_position)
-            pos_step.append(list(obj_position[:2]))
-        return pos_step
+        return self.getPositions()[1]
+
+    def getPositions(self):
+        if self.lastPositions is not None:
+            # positions returned by a server side step are still current
+            positions, self.lastPositions = self.lastPositions, None
+            return positions
+        # box and block positions are read in a single batched round trip
+        handles = [self.boxHandle] + self.object_shapes_handles
+        positions = self.client.callMany([('sim.getObjectPosition', [handle, self.sim.handle_world]) for handle in handles])
+        box_position = positions[0]
+        pos_step = [list(obj_position[:2]) for obj_position in positions[1:]]
+        return box_position, pos_step
     
     def getBoxPosition(self):
         return self.sim.getObjectPosition(self.boxHandle,self.sim.handle_world)
@@ -106,8 +174,6 @@ class Simulation():
         if direction not in self.directions:
             print(f'Direction: {direction} invalid, please choose one from {self.directions}')
             return
-        box_position = self.sim.getObjectPosition(self.boxHandle,self.sim.handle_world)
-        _box_position = box_position
         span = 0.02
         steps = 5
         if direction == 'Up':
@@ -123,13 +189,31 @@ class Simulation():
             idx = 0
             dirs = [-1, 1]
 
+        self.lastPositions = None
+        if self.server_step:
+            try:
+                self.serverAction(idx, dirs, span, steps)
+                return
+            except Exception as e:
+                # only a scene without envStep falls back, other errors are bugs
+                if not unknownFunction(e, 'envStep'):
+                    raise
+                print(f'Server side step failed ({e}), stepping from the client instead')
+                self.server_step = False
+
+        box_position = self.sim.getObjectPosition(self.boxHandle,self.sim.handle_world)
+        _box_position = box_position
         for _dir in dirs:
             for _ in range(steps):
                 _box_position[idx] += _dir*span / steps
                 self.sim.setObjectPosition(self.boxHandle, self.sim.handle_world, _box_position)
                 self.stepSim()
-        
-        
+
+    def serverAction(self, idx, dirs, span, steps):
+        handles = [self.boxHandle] + self.object_shapes_handles
+        _, retFloats, *_ = self.sim.callScriptFunction('envStep',self.scriptHandle,[idx]+handles,[span,steps]+dirs,[])
+        positions = np.asarray(retFloats).reshape(len(handles), 3)
+        self.lastPositions = (positions[0].tolist(), positions[1:, :2].tolist())
 
     def getDirectionNo(self,direction):
         if(direction=='Up'):
@@ -151,67 +235,25 @@ class Simulation():
         if(directionNo==3):
             return 'Left'
 
-    def stepSim(self):
-        self.client.step()
+    def stepSim(self, n=1):
+        self.client.step(n)
 
     def stopSim(self):
+        # ends the episode for good and hands the connection back for the next client
         self.sim.stopSimulation()
+        self.client.close()
+
+STATE_ENGINE = StateEngine(grid=2)
 
 def get_current_state(env):
-    box_position = env.getBoxPosition()
-    positions = env.getObjectsPositions()
-    first,second,third,fourth = [0,0] , [0,0] , [0,0] ,[0,0]
-    for i in range(18):
-        #print("box position : ",box_position," cylinder positions : ",positions[i])
-        if(positions[i][0]<box_position[0] and positions[i][1]<box_position[1]):
-            if i<9:
-                third[0]=third[0]+1
-            else:
-                third[1]=third[1]+1
-        if(positions[i][0]<box_position[0] and positions[i][1]>box_position[1]):
-            if i<9:
-                first[0]=first[0]+1
-            else:
-                first[1]=first[1]+1
-        if(positions[i][0]>box_position[0] and positions[i][1]<box_position[1]):
-            if i<9:
-                fourth[0]=fourth[0]+1
-            else:
-                fourth[1]=fourth[1]+1
-        if(positions[i][0]>box_position[0] and positions[i][1]>box_position[1]):
-            if i<9:
-                second[0]=second[0]+1
-            else:
-                second[1]=second[1]+1
-    state=0
-    reward=0
-    if(first[0]==first[1]):
-        state+=1
-        reward+=1
-    else:
-        reward-=1
-    if(second[0]==second[1]):
-        state+=2
-        reward+=1
-    else:
-        reward-=1
-    if(third[0]==third[1]):
-        state+=4
-        reward+=1
-    else:
-        reward-=1
-    if(fourth[0]==fourth[1]):
-        state+=8
-        reward+=1
-    else:
-        reward-=1
-    
-    # if(state == 7 or state ==  11 or state == 13 or  state == 14 or state ==  3 or state == 5 or  state == 6 or  state == 9 or  state == 10 or  state == 12 or  state == 15):
-    #     reward+=2
-    # if(state == 15):
-    #     print("current state is: ", state," !!!!!", first,second,third,fourth)
-    # print("current state is: ", state," !!!!!", first,second,third,fourth)
-    return state,reward
+    state, reward, box_position, positions = observe(env)
+    return state, reward
+
+def observe(env):
+    # state and reward together with the positions they were computed from
+    box_position, positions = env.getPositions()
+    state, reward, counts = STATE_ENGINE.evaluate(box_position, positions, env.colours)
+    return int(state), int(reward), box_position, positions
    
 
 class QLearningNetwork(nn.Module):
@@ -241,104 +283,304 @@ class QLearningNetwork(nn.Module):
         # print("direction: ",direction)
         return direction
 
+    def actBatch(self, obs):
+        # greedy directions for a batch of integer states in one forward pass
+        with torch.no_grad():
+            q_values = self(state_bits(obs))
+        return torch.argmax(q_values, dim=1).numpy()
+
+def state_bits(states):
+    # same encoding as '{0:04b}'.format(state), most significant bit first
+    states = torch.as_tensor(np.asarray(states), dtype=torch.int64)
+    return ((states.unsqueeze(-1) >> torch.arange(3, -1, -1)) & 1).to(torch.float32)
+
+STATE_BITS = state_bits(np.arange(16)).numpy()
+
 BUFFER_SIZE=32  
 BATCH_SIZE=4
 GAMMA=0.85
 UPDATE_FREQ=50
 EPISODES=100
 STEPS=30
-env = Simulation()
-
-replayBuffer = deque(maxlen=BUFFER_SIZE)
-
-episode_reward = 0.0
-
-Q_network = QLearningNetwork(env)
-target_network = QLearningNetwork(env)
-
-target_network.load_state_dict(Q_network.state_dict())
-
-optimizer = torch.optim.Adam(Q_network.parameters(),lr=0.40)
-
-
-for i in range(EPISODES):
-  with open("trainingLogs", "a") as f:
-      f.write(f"Episode : {i+1}\n")
-
-  current_state,reward = get_current_state(env)
-  epsilon = max(0.01, np.exp(-0.001*i))
-  for j in range(STEPS):
-
-    if random.random() < epsilon:
-        direction = np.random.choice(env.directions)
-        # print("random choice ",direction)
-        env.action(direction)
+LEARNING_RATE=0.40
+EPSILON_DECAY=0.001
+REBUILD_ON_RESET=False
+# one round trip per action, but physics differ from client stepping (see envStep.lua)
+SERVER_STEP=False
+# train against the NumPy surrogate instead of a running CoppeliaSim
+SURROGATE=False
+PRIORITIZED_REPLAY=False
+PER_ALPHA=0.6
+PER_BETA=0.4
+METRICS_FILE="trainingLogs.jsonl"
+CHECKPOINT_DIR="checkpoints"
+CHECKPOINT_EVERY=10
+CHECKPOINT_KEEP=3
+# continue from the newest checkpoint, also python3 exec_environment.py --resume
+RESUME=False
+# actor processes and a learner side by side, see actor_learner.py
+ACTOR_LEARNER=False
+# every observation of train() is appended here when set, see trajectories.py
+TRAJECTORY_DIR=""
+# simulators stepped side by side by train(), on ports PORT_STRIDE apart (see vector_env.py)
+NUM_ENVS=1
+
+def optimize(Q_network, target_network, optimizer, replayBuffer, batch_size=None, gamma=None):
+    # one gradient step on a sampled batch, returns the loss and the TD errors
+    batch_size = BATCH_SIZE if batch_size is None else batch_size
+    gamma = GAMMA if gamma is None else gamma
+    prioritized = isinstance(replayBuffer, PrioritizedReplayBuffer)
+    if prioritized:
+        states, directions, rewards, termination_flags, new_states, weights, indices = replayBuffer.sample(batch_size)
     else:
-        directionNo = Q_network.act(current_state)
-        direction = env.getDirection(directionNo)
-        # print("nn choice ",direction, directionNo)
-        env.action(direction)
-
-
-    new_state,reward = get_current_state(env)
-    transition = ([int(i) for  element in '{0:04b}'.format(current_state) for i in element], env.getDirectionNo(direction), reward, new_state==15, [int(i) for  element in '{0:04b}'.format(new_state) for i in element])
-    replayBuffer.append(transition)
-    current_state = new_state
-    # print("the new obsss ", obs)
-    episode_reward += reward
-
-    # if(new_obs == 15):
-    #     env.stopSim()  
-    #     env = Simulation()
-
-    #     rew_buffer.append(episode_reward)
-    #     episode_reward = 0.0
-
-    if(len(replayBuffer)<BATCH_SIZE):
-        continue
-
-    transitions = random.sample(replayBuffer, BATCH_SIZE)
-    # print("transitions :::: ",transitions)
-
-    states = torch.tensor([t[0] for t in transitions], dtype=torch.float32)
-    # directions = torch.unsqueeze(torch.tensor([t[1] for t in transitions], dtype=torch.float32), dim=-1)
-    rewards = torch.unsqueeze(torch.tensor([t[2] for t in transitions], dtype=torch.float32), dim=-1)
-    termination_flags = torch.unsqueeze(torch.tensor([t[3] for t in transitions], dtype=torch.float32), dim=-1)
-    new_states = torch.tensor([t[4] for t in transitions], dtype=torch.float32)
-
-   
+        states, directions, rewards, termination_flags, new_states = replayBuffer.sample(batch_size)
+        weights = torch.ones_like(rewards)
 
     newQ = target_network(new_states)
-    
-    targetValues = rewards + GAMMA * (1 - termination_flags) * torch.max(newQ, dim=1, keepdim=True)[0]
-    
+    targetValues = rewards + gamma * (1 - termination_flags) * torch.max(newQ, dim=1, keepdim=True)[0]
 
     qValues = Q_network(states)
-    with open("trainingLogs", "a") as f:
-      f.write(f"TD error: {(targetValues-torch.max(qValues, dim=1, keepdim=True)[0]).tolist()}\n")
+    td_errors = targetValues-torch.max(qValues, dim=1, keepdim=True)[0]
+    if prioritized:
+        replayBuffer.updatePriorities(indices, td_errors.detach().numpy())
 
-    loss = nn.functional.smooth_l1_loss(torch.max(qValues, dim=1, keepdim=True)[0], targetValues)
+    # importance sampling weights are all ones with uniform replay
+    loss = (weights * nn.functional.smooth_l1_loss(torch.max(qValues, dim=1, keepdim=True)[0], targetValues, reduction='none')).mean()
 
     optimizer.zero_grad()
     loss.backward()
     optimizer.step()
+    return loss.item(), td_errors.detach().numpy()
+
+def train(episodes=None, steps=None, buffer_size=None, batch_size=None, gamma=None, update_freq=None,
+          lr=None, epsilon_decay=None, surrogate=None, sim_port=23000, server_step=None, metrics_file=None,
+          checkpoint_dir=None, resume=None, model_file="model", policy_file="model_policy.npz", on_episode=None,
+          trajectory_dir=None, num_envs=None, seed=None):
+    # arguments left as None fall back to the module constants; checkpoint_dir=''
+    # disables checkpoints and model_file/policy_file='' skip the final save.
+    # on_episode(episode, steps, reward, epsilon) is called after every episode
+    # and stops the run when it returns True, e.g. to prune a sweep trial.
+    # With num_envs > 1 the episodes run on a VectorSimulation (or a
+    # SurrogateBatch) and every step adds one transition per simulator.
+    # seed fixes the surrogate scenes.
+    episodes = EPISODES if episodes is None else episodes
+    steps = STEPS if steps is None else steps
+    buffer_size = BUFFER_SIZE if buffer_size is None else buffer_size
+    batch_size = BATCH_SIZE if batch_size is None else batch_size
+    gamma = GAMMA if gamma is None else gamma
+    update_freq = UPDATE_FREQ if update_freq is None else update_freq
+    lr = LEARNING_RATE if lr is None else lr
+    epsilon_decay = EPSILON_DECAY if epsilon_decay is None else epsilon_decay
+    surrogate = SURROGATE if surrogate is None else surrogate
+    server_step = SERVER_STEP if server_step is None else server_step
+    metrics_file = METRICS_FILE if metrics_file is None else metrics_file
+    checkpoint_dir = CHECKPOINT_DIR if checkpoint_dir is None else checkpoint_dir
+    resume = RESUME if resume is None else resume
+    trajectory_dir = TRAJECTORY_DIR if trajectory_dir is None else trajectory_dir
+    num_envs = NUM_ENVS if num_envs is None else num_envs
+
+    if num_envs > 1:
+        if trajectory_dir:
+            raise ValueError('trajectories are only recorded with a single simulator')
+        if surrogate:
+            env = SurrogateBatch(num_envs, seed=seed)
+        else:
+            env = VectorSimulation(num_envs, base_port=sim_port, server_step=server_step)
+    elif surrogate:
+        env = SurrogateSimulation(seed=seed)
+    else:
+        env = Simulation(sim_port=sim_port, server_step=server_step)
+
+    # a failing run must not leave the simulator running
+    metrics = recorder = None
+    try:
+        if PRIORITIZED_REPLAY:
+            replayBuffer = PrioritizedReplayBuffer(buffer_size, alpha=PER_ALPHA, beta=PER_BETA)
+        else:
+            replayBuffer = ReplayBuffer(buffer_size)
+
+        episode_reward = 0.0
+        history = []
+
+        Q_network = QLearningNetwork(env)
+        target_network = QLearningNetwork(env)
 
-    if j % UPDATE_FREQ == 0:
         target_network.load_state_dict(Q_network.state_dict())
-    # for key in online_net.state_dict():
-    #         target_net.state_dict()[key] = online_net.state_dict()[key]*epsilon + target_net.state_dict()[key]*(1-epsilon)
 
-    if(new_state == 15):
-        # print("Done, step: ",j)
-        break
+        optimizer = torch.optim.Adam(Q_network.parameters(),lr=lr)
+
+        start_episode = 0
+        checkpoint_path = latest_checkpoint(checkpoint_dir) if resume and checkpoint_dir else None
+        if checkpoint_path:
+            last_episode, epsilon = load_checkpoint(checkpoint_path, Q_network, target_network, optimizer, replayBuffer)
+            start_episode = last_episode + 1
+            print(f'Resuming from {checkpoint_path} at episode {start_episode + 1}')
+            # episodes logged after the checkpoint are run again
+            truncate_metrics(metrics_file, start_episode)
+
+        metrics = MetricsWriter(metrics_file)
+        recorder = TrajectoryRecorder(trajectory_dir, env.blocks, env.colours) if trajectory_dir else None
+        if recorder and checkpoint_path:
+            recorder.discardAfter(start_episode - 1)
+
+        if num_envs > 1:
+          # every simulator runs its own episode, numbered in the order they start;
+          # one update per vector step on the transitions of all of them
+          states = np.asarray(env.reset())
+          episode_ids = np.full(num_envs, -1)
+          episode_steps = np.zeros(num_envs, dtype=np.int64)
+          episode_rewards = np.zeros(num_envs)
+          next_episode = start_episode
+          # episodes finish out of order; completed_until counts the leading run of
+          # finished episodes, finished ones past it wait in finished_ahead
+          completed_until = start_episode
+          finished_ahead = set()
+          for k in range(num_envs):
+              if next_episode < episodes:
+                  episode_ids[k] = next_episode
+                  next_episode += 1
+          updates = 0
+          stop = False
+          while (episode_ids >= 0).any() and not stop:
+            active = episode_ids >= 0
+            epsilons = np.maximum(0.01, np.exp(-epsilon_decay*np.maximum(episode_ids, 0)))
+            directionNos = select_directions(Q_network, states, epsilons)
+            new_states, rewards, dones = env.step(directionNos)
+            new_states = np.asarray(new_states)
+            replayBuffer.addBatch(STATE_BITS[states[active]], directionNos[active], rewards[active], dones[active], STATE_BITS[new_states[active]])
+            episode_steps[active] += 1
+            episode_rewards[active] += rewards[active]
+            states = new_states
+
+            if len(replayBuffer) >= batch_size:
+                loss, td_errors = optimize(Q_network, target_network, optimizer, replayBuffer, batch_size, gamma)
+                updates += 1
+                metrics.logStep(episode=int(episode_ids.max())+1, step=updates, loss=loss, td_error=td_errors, epsilon=float(epsilons[active].mean()))
+                if updates % update_freq == 0:
+                    target_network.load_state_dict(Q_network.state_dict())
+
+            ended = active & (np.asarray(dones, dtype=bool) | (episode_steps >= steps))
+            for k in np.flatnonzero(ended):
+                i = int(episode_ids[k])
+                metrics.logEpisode(episode=i+1, steps=int(episode_steps[k]), reward=float(episode_rewards[k]), epsilon=float(epsilons[k]))
+                history.append((int(episode_steps[k]), float(episode_rewards[k]), bool(dones[k])))
+                finished_ahead.add(i)
+                while completed_until in finished_ahead:
+                    finished_ahead.discard(completed_until)
+                    completed_until += 1
+                stop = (on_episode is not None and on_episode(i, int(episode_steps[k]), float(episode_rewards[k]), float(epsilons[k]))) or stop
+                if checkpoint_dir and len(history) % CHECKPOINT_EVERY == 0:
+                    metrics.flush()
+                    # a resume starts after the leading finished episodes; later ones,
+                    # finished or still running, are run again and their records dropped
+                    save_checkpoint(checkpoint_dir, completed_until-1, Q_network, target_network, optimizer, replayBuffer, float(epsilons[k]), keep=CHECKPOINT_KEEP)
+                episode_ids[k] = next_episode if next_episode < episodes else -1
+                next_episode += 1
+                episode_steps[k] = 0
+                episode_rewards[k] = 0.0
+            if ended.any():
+                states = np.asarray(env.reset(ended, rebuild=REBUILD_ON_RESET))
+        else:
+            for i in range(start_episode, episodes):
+              current_state,reward,box_position,positions = observe(env)
+              if recorder:
+                  recorder.recordStep(None, box_position, positions, reward, current_state)
+              epsilon = max(0.01, np.exp(-epsilon_decay*i))
+              for j in range(steps):
+
+                if random.random() < epsilon:
+                    direction = np.random.choice(env.directions)
+                    # print("random choice ",direction)
+                    env.action(direction)
+                else:
+                    directionNo = Q_network.act(current_state)
+                    direction = env.getDirection(directionNo)
+                    # print("nn choice ",direction, directionNo)
+                    env.action(direction)
+
+
+                new_state,reward,box_position,positions = observe(env)
+                if recorder:
+                    recorder.recordStep(env.getDirectionNo(direction), box_position, positions, reward, new_state)
+                replayBuffer.add(STATE_BITS[current_state], env.getDirectionNo(direction), reward, new_state==15, STATE_BITS[new_state])
+                current_state = new_state
+                # print("the new obsss ", obs)
+                episode_reward += reward
+
+                # if(new_obs == 15):
+                #     env.stopSim()  
+                #     env = Simulation()
+
+                #     rew_buffer.append(episode_reward)
+                #     episode_reward = 0.0
+
+                if(len(replayBuffer)<batch_size):
+                    continue
+
+                loss, td_errors = optimize(Q_network, target_network, optimizer, replayBuffer, batch_size, gamma)
+                metrics.logStep(episode=i+1, step=j+1, loss=loss, td_error=td_errors, reward=reward, epsilon=epsilon)
+
+                if j % update_freq == 0:
+                    target_network.load_state_dict(Q_network.state_dict())
+                # for key in online_net.state_dict():
+                #         target_net.state_dict()[key] = online_net.state_dict()[key]*epsilon + target_net.state_dict()[key]*(1-epsilon)
+
+                if(new_state == 15):
+                    # print("Done, step: ",j)
+                    break
     
         
 
-  env.stopSim()  
-  env = Simulation()
-  with open("trainingLogs", "a") as f:
-      f.write(f'Episode : {i+1} , accumulated reward : {episode_reward}\n') 
-  episode_reward = 0.0    
+              env.reset(rebuild=REBUILD_ON_RESET)
+              if recorder:
+                  recorder.endEpisode(i)
+              metrics.logEpisode(episode=i+1, steps=j+1, reward=episode_reward, epsilon=epsilon)
+              history.append((j+1, episode_reward, new_state == 15))
+              stop = on_episode is not None and on_episode(i, j+1, episode_reward, epsilon)
+              episode_reward = 0.0    
+              if checkpoint_dir and (i+1) % CHECKPOINT_EVERY == 0:
+                  metrics.flush()
+                  save_checkpoint(checkpoint_dir, i, Q_network, target_network, optimizer, replayBuffer, epsilon, keep=CHECKPOINT_KEEP)
+              if stop:
+                  break
+
+        if model_file:
+            torch.save(Q_network.state_dict(), model_file)
+        if policy_file:
+            export_policy(Q_network, policy_file)
+        return summarize_history(history)
+    finally:
+        if metrics is not None:
+            metrics.close()
+        if recorder:
+            recorder.close()
+        if num_envs > 1:
+            env.close()
+        else:
+            env.stopSim()
+
+
+def summarize_history(history, window=10):
+    """Steps, reward and solve rate over the last window episodes of a run."""
+    recent = history[-window:]
+    if not recent:
+        return {'episodes_run': len(history), 'mean_steps': None, 'mean_reward': None, 'solve_rate': None}
+    steps, rewards, solved = zip(*recent)
+    return {'episodes_run': len(history), 'mean_steps': float(np.mean(steps)), 'mean_reward': float(np.mean(rewards)),
+            'solve_rate': float(np.mean(solved))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the Q-network on the box shaking scene.')
+    parser.add_argument('--resume', action='store_true', default=RESUME,
+                        help=f'continue from the newest checkpoint in {CHECKPOINT_DIR}')
+    args = parser.parse_args()
+    if ACTOR_LEARNER:
+        from actor_learner import train_actor_learner
+        train_actor_learner(resume=args.resume)
+    else:
+        train(resume=args.resume)
+
 
-torch.save(Q_network.state_dict(), "model")
-env.stopSim()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+    Buffered training metrics in JSON Lines format.
+
+    Every record is one JSON object per line with a "kind" field:
+        step:    episode, step, loss, td_error (list), reward, epsilon
+        episode: episode, steps, reward, epsilon
+
+    MetricsWriter keeps the file open and writes buffered records in bulk:
+    after every episode record, when the buffer fills up or max_delay seconds
+    after the last write, or from a background thread. Whatever is still
+    buffered is written by close(), which also runs at interpreter exit, so
+    at most the steps of the current episode are lost if the process is
+    killed.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+STEP_FIELDS = {'episode': int, 'step': int, 'loss': float, 'td_error': list, 'reward': float, 'epsilon': float}
+EPISODE_FIELDS = {'episode': int, 'steps': int, 'reward': float, 'epsilon': float}
+MAX_DELAY = 5.0
+
+
+class MetricsWriter():
+    def __init__(self, path, buffer_size=1000, flush_interval=None, max_delay=MAX_DELAY):
+        """
+            buffer_size: records kept in memory before they are written.
+            flush_interval: if set, a background thread also writes the buffer
+                every flush_interval seconds and the training loop never does.
+            max_delay: otherwise the training loop also writes the buffer
+                when its last write is older than this, in seconds.
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.max_delay = max_delay
+        self.file = open(path, 'a')
+        self.records = []
+        self.lastFlush = time.monotonic()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if flush_interval is not None:
+            self.thread = threading.Thread(target=self._flushLoop, args=(flush_interval,), daemon=True)
+            self.thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def _flushLoop(self, interval):
+        while not self.stopped.wait(interval):
+            self.flush()
+
+    def _log(self, kind, fields, values):
+        record = {'kind': kind}
+        for name, cast in fields.items():
+            if name in values:
+                value = values[name]
+                record[name] = [float(v) for v in np.ravel(value)] if cast is list else cast(value)
+        with self.lock:
+            self.records.append(record)
+            full = self.thread is None and (kind == 'episode' or len(self.records) >= self.buffer_size
+                                            or time.monotonic() - self.lastFlush >= self.max_delay)
+        if full:
+            self.flush()
+
+    def logStep(self, **values):
+        self._log('step', STEP_FIELDS, values)
+
+    def logEpisode(self, **values):
+        self._log('episode', EPISODE_FIELDS, values)
+
+    def flush(self):
+        with self.lock:
+            records, self.records = self.records, []
+            self.lastFlush = time.monotonic()
+        if records and not self.file.closed:
+            self.file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+            self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        atexit.unregister(self.close)
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+        self.flush()
+        self.file.close()
+
+
+def read_metrics(path, kind=None):
+    """Yield the records in path, optionally only those of one kind."""
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if kind is None or record['kind'] == kind:
+                yield record
+
+
+def truncate_metrics(path, episode):
+    """
+        Drop the records of episodes after episode (numbered from 1), e.g.
+        those logged after the checkpoint a resumed run starts from.
+    """
+    if not os.path.exists(path):
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as out, open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash
+                    continue
+                if record.get('episode', 0) <= episode:
+                    out.write(line)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _column(values, cast):
+    if cast is list:
+        return values
+    if cast is float:
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.array([-1 if v is None else v for v in values], dtype=np.int64)
+
+
+def load_columns(path, kind='step'):
+    """
+        Records of one kind as a dict of NumPy columns. Missing floats are NaN,
+        missing integers -1 and td_error stays a list of lists.
+    """
+    fields = STEP_FIELDS if kind == 'step' else EPISODE_FIELDS
+    columns = {name: [] for name in fields}
+    for record in read_metrics(path, kind):
+        for name in fields:
+            columns[name].append(record.get(name))
+    return {name: _column(values, fields[name]) for name, values in columns.items()}
@@ -0,0 +1,82 @@
+"""
+    Load a saved Q-network without knowing its class.
+
+    The repo has checkpoints with different layouts, e.g. "model" uses
+    layer1/layer2/layer3 with 128 hidden units and "modelFirstThousand" uses
+    net.0 ... net.5 with 64 hidden units. load_model reads the state dict
+    memory-mapped, finds the chain of linear layers from its keys and shapes
+    and builds a matching MLP (ReLU between layers, as in QLearningNetwork)
+    whose parameters share the mapped storage.
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from exec_environment import state_bits
+
+
+def _linear_layers(state_dict):
+    # module paths of the linear layers, in the order they were saved
+    layers = []
+    for key, tensor in state_dict.items():
+        if not key.endswith('.weight'):
+            continue
+        path = key[:-len('.weight')]
+        if tensor.dim() != 2:
+            raise ValueError(f'{key} has shape {tuple(tensor.shape)}, expected a linear layer weight')
+        layers.append((path, tensor.shape[1], tensor.shape[0], f'{path}.bias' in state_dict))
+    expected = {f'{path}.{name}' for path, _, _, bias in layers for name in (('weight', 'bias') if bias else ('weight',))}
+    unexpected = set(state_dict) - expected
+    if unexpected:
+        raise ValueError(f'unsupported parameters: {sorted(unexpected)}')
+    if not layers:
+        raise ValueError('no linear layers found')
+    for (path, _, out_features, _), (next_path, in_features, _, _) in zip(layers, layers[1:]):
+        if out_features != in_features:
+            raise ValueError(f'{path} outputs {out_features} features but {next_path} takes {in_features}')
+    return layers
+
+
+class MLPNetwork(nn.Module):
+    def __init__(self, layers):
+        """layers: (module path, in_features, out_features, bias) per linear layer."""
+        super().__init__()
+        self.paths = [path for path, _, _, _ in layers]
+        for path, in_features, out_features, bias in layers:
+            parent = self
+            *containers, name = path.split('.')
+            for container in containers:
+                if container not in parent._modules:
+                    parent.add_module(container, nn.ModuleDict())
+                parent = parent._modules[container]
+            parent.add_module(name, nn.Linear(in_features, out_features, bias=bias))
+        self.linears = [self.get_submodule(path) for path in self.paths]
+
+    def forward(self, x):
+        for linear in self.linears[:-1]:
+            x = F.relu(linear(x))
+        return self.linears[-1](x)
+
+    def act(self, obs):
+        return self.actBatch([obs])[0].item()
+
+    def actBatch(self, obs):
+        with torch.no_grad():
+            q_values = self(state_bits(obs))
+        return torch.argmax(q_values, dim=1).numpy()
+
+
+def describe(path):
+    """Layer layout of a saved model, e.g. [('layer1', 4, 128, True), ...]."""
+    return _linear_layers(torch.load(path, mmap=True, weights_only=True, map_location='cpu'))
+
+
+def load_model(path):
+    """Build the network matching the saved state dict at path, in eval mode."""
+    state_dict = torch.load(path, mmap=True, weights_only=True, map_location='cpu')
+    with torch.device('meta'):
+        network = MLPNetwork(_linear_layers(state_dict))
+    # assign keeps the memory-mapped tensors instead of copying them
+    network.load_state_dict(state_dict, assign=True)
+    return network.eval()
@@ -0,0 +1,54 @@
+"""
+    Q-table policy compiled from a trained network.
+
+    The observation is a 4 bit mask, so the network can be evaluated once on
+    all 16 states and replaced by a 16x4 table. The table is saved as an .npz
+    file with the Q-values and the greedy action of every state, and
+    TablePolicy serves actions from it with plain NumPy indexing, without
+    importing torch.
+
+    Export a trained model:
+    python3 policy_table.py model model_policy.npz
+"""
+
+import sys
+
+import numpy as np
+
+NUM_STATES = 16
+
+
+def export_policy(network, path):
+    """Evaluate network on every state and save the Q-table to path."""
+    import torch
+    from exec_environment import state_bits
+    with torch.no_grad():
+        q_values = network(state_bits(np.arange(NUM_STATES))).numpy().astype(np.float32)
+    actions = np.argmax(q_values, axis=1).astype(np.int8)
+    with open(path, 'wb') as f:
+        np.savez(f, q_values=q_values, actions=actions)
+    return q_values
+
+
+class TablePolicy():
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.q_values = data['q_values']
+            self.actions = data['actions'].tolist()
+
+    def act(self, obs):
+        return self.actions[obs]
+
+
+def main():
+    import torch
+    from exec_environment import QLearningNetwork
+    model_path, policy_path = sys.argv[1:3]
+    network = QLearningNetwork(None)
+    network.load_state_dict(torch.load(model_path))
+    q_values = export_policy(network, policy_path)
+    print(f'Saved {q_values.shape[0]}x{q_values.shape[1]} Q-table to {policy_path}')
+
+
+if __name__ == '__main__':
+    main()
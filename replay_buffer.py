@@ -0,0 +1,289 @@
+"""
+    Replay buffer stored in preallocated NumPy arrays.
+
+    Transitions are written into a ring of fixed size arrays and sampled by
+    index, so a batch is gathered with a handful of array operations whatever
+    the buffer or batch size. SharedReplayBuffer keeps the same arrays in
+    shared memory so several processes can fill it.
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+
+class ReplayBuffer():
+    def __init__(self, capacity, state_dim=4, seed=None):
+        self.capacity = capacity
+        self.states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.float32)
+        self.new_states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.position = 0
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def _store(self, idx, state, action, reward, done, new_state):
+        self.states[idx] = state
+        self.actions[idx] = action
+        self.rewards[idx] = reward
+        self.dones[idx] = done
+        self.new_states[idx] = new_state
+
+    def add(self, state, action, reward, done, new_state):
+        """Store one transition, overwriting the oldest once the buffer is full."""
+        idx = self.position
+        self._store(idx, state, action, reward, done, new_state)
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return idx
+
+    def addBatch(self, states, actions, rewards, dones, new_states):
+        """Store a batch of transitions, e.g. one step of a VectorSimulation."""
+        idx = (self.position + np.arange(len(actions))) % self.capacity
+        self._store(idx, states, actions, rewards, dones, new_states)
+        self.position = (self.position + len(actions)) % self.capacity
+        self.size = min(self.size + len(actions), self.capacity)
+        return idx
+
+    def sampleIndices(self, batch_size):
+        return self.rng.integers(0, self.size, size=batch_size)
+
+    def batch(self, idx):
+        """
+            Tensors for the transitions at idx: states (B, state_dim), actions
+            (B, 1), rewards (B, 1), dones (B, 1) and new states (B, state_dim).
+        """
+        return (torch.from_numpy(self.states[idx]),
+                torch.from_numpy(self.actions[idx]).unsqueeze(-1),
+                torch.from_numpy(self.rewards[idx]).unsqueeze(-1),
+                torch.from_numpy(self.dones[idx]).unsqueeze(-1),
+                torch.from_numpy(self.new_states[idx]))
+
+    def sample(self, batch_size):
+        """Uniformly sample batch_size transitions (with replacement)."""
+        return self.batch(self.sampleIndices(batch_size))
+
+    def state_dict(self):
+        """Contents and sampling state, e.g. for checkpoints."""
+        n = self.size
+        return {'states': self.states[:n].copy(), 'actions': self.actions[:n].copy(),
+                'rewards': self.rewards[:n].copy(), 'dones': self.dones[:n].copy(),
+                'new_states': self.new_states[:n].copy(), 'position': self.position,
+                'rng': self.rng.bit_generator.state}
+
+    def load_state_dict(self, state):
+        n = len(state['actions'])
+        if n > self.capacity:
+            raise ValueError(f'buffer holds {n} transitions, capacity is {self.capacity}')
+        self._store(slice(0, n), state['states'], state['actions'], state['rewards'], state['dones'], state['new_states'])
+        self.size = n
+        # a restored ring that is not full simply continues after its last entry
+        self.position = state['position'] % self.capacity if n == self.capacity else n
+        self.rng.bit_generator.state = state['rng']
+
+
+class SumTree():
+    """
+        Binary tree whose internal nodes hold the sum of their children, stored
+        in one array with the root at index 1 and the leaves at [size, 2*size).
+        Updates and proportional lookups are done for whole batches at once.
+    """
+
+    def __init__(self, capacity):
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.tree = np.zeros(2 * self.size, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, idx):
+        return self.tree[self.size + np.asarray(idx)]
+
+    def update(self, idx, priorities):
+        nodes = self.size + np.asarray(idx, dtype=np.int64).ravel()
+        if not len(nodes):
+            return
+        self.tree[nodes] = np.asarray(priorities, dtype=np.float64).ravel()
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """Leaf index for each value in [0, total), descending all values together."""
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.size:
+            left = 2 * nodes
+            leftSum = self.tree[left]
+            goLeft = values < leftSum
+            values = np.where(goLeft, values, values - leftSum)
+            nodes = np.where(goLeft, left, left + 1)
+        return nodes - self.size
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+        Proportional prioritized replay (Schaul et al. 2016). Transitions are
+        sampled with probability p_i^alpha / sum p^alpha where p_i is the last
+        absolute TD error of the transition, and sample() also returns the
+        importance sampling weights that correct for the non-uniform sampling.
+    """
+
+    def __init__(self, capacity, state_dim=4, alpha=0.6, beta=0.4, eps=1e-3, seed=None):
+        super().__init__(capacity, state_dim=state_dim, seed=seed)
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def add(self, state, action, reward, done, new_state):
+        # new transitions get the highest priority seen so they are replayed at least once
+        idx = super().add(state, action, reward, done, new_state)
+        self.tree.update([idx], [self.max_priority ** self.alpha])
+        return idx
+
+    def addBatch(self, states, actions, rewards, dones, new_states):
+        idx = super().addBatch(states, actions, rewards, dones, new_states)
+        self.tree.update(idx, np.full(len(idx), self.max_priority ** self.alpha))
+        return idx
+
+    def sampleIndices(self, batch_size):
+        # one value per equal slice of the total keeps the batch spread out
+        segment = self.tree.total() / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        return np.minimum(self.tree.find(values), self.size - 1)
+
+    def sample(self, batch_size, beta=None):
+        """
+            Returns the batch tensors of ReplayBuffer.sample followed by the
+            importance sampling weights (B, 1) and the sampled indices, which
+            are needed to update the priorities afterwards.
+        """
+        beta = self.beta if beta is None else beta
+        idx = self.sampleIndices(batch_size)
+        probabilities = self.tree.get(idx) / self.tree.total()
+        weights = (self.size * probabilities) ** -beta
+        weights = (weights / weights.max()).astype(np.float32)
+        return self.batch(idx) + (torch.from_numpy(weights).unsqueeze(-1), idx)
+
+    def state_dict(self):
+        state = super().state_dict()
+        state['priorities'] = self.tree.get(np.arange(self.size))
+        state['max_priority'] = self.max_priority
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.tree = SumTree(self.capacity)
+        # checkpoints of a uniform buffer carry no priorities
+        self.max_priority = state.get('max_priority', 1.0)
+        priorities = state.get('priorities', np.full(self.size, self.max_priority ** self.alpha))
+        self.tree.update(np.arange(self.size), priorities)
+
+    def updatePriorities(self, idx, td_errors):
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64).ravel()) + self.eps
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(idx, priorities ** self.alpha)
+
+
+class SharedReplayBuffer(ReplayBuffer):
+    """
+        ReplayBuffer whose arrays live in one shared memory block, so actor
+        processes can add transitions while a learner samples them. The
+        buffer is passed to spawned processes as a Process argument; adds and
+        samples hold a shared lock, so a batch never sees a half written
+        transition. The creating process unlinks the block in close().
+    """
+
+    def __init__(self, capacity, state_dim=4, seed=None, ctx=None):
+        self.capacity = capacity
+        self.state_dim = state_dim
+        self.rng = np.random.default_rng(seed)
+        self.lock = (ctx or multiprocessing).Lock()
+        self.shm = shared_memory.SharedMemory(create=True, size=self._nbytes())
+        self.owner = True
+        self._attach()
+        self.header[:] = 0
+
+    def _layout(self):
+        capacity, state_dim = self.capacity, self.state_dim
+        # header: position, size and the number of transitions ever added
+        return [('header', (3,), np.int64), ('states', (capacity, state_dim), np.float32),
+                ('actions', (capacity,), np.int64), ('rewards', (capacity,), np.float32),
+                ('dones', (capacity,), np.float32), ('new_states', (capacity, state_dim), np.float32)]
+
+    def _nbytes(self):
+        return sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in self._layout())
+
+    def _attach(self):
+        offset = 0
+        for name, shape, dtype in self._layout():
+            array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+
+    def __getstate__(self):
+        return {'capacity': self.capacity, 'state_dim': self.state_dim, 'lock': self.lock, 'shm': self.shm}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.rng = np.random.default_rng()
+        self.owner = False
+        self._attach()
+
+    @property
+    def position(self):
+        return int(self.header[0])
+
+    @position.setter
+    def position(self, value):
+        self.header[0] = value
+
+    @property
+    def size(self):
+        return int(self.header[1])
+
+    @size.setter
+    def size(self, value):
+        self.header[1] = value
+
+    @property
+    def added(self):
+        """Transitions added since the buffer was created, from all processes."""
+        return int(self.header[2])
+
+    def add(self, state, action, reward, done, new_state):
+        with self.lock:
+            self.header[2] += 1
+            return super().add(state, action, reward, done, new_state)
+
+    def addBatch(self, states, actions, rewards, dones, new_states):
+        with self.lock:
+            self.header[2] += len(actions)
+            return super().addBatch(states, actions, rewards, dones, new_states)
+
+    def sample(self, batch_size):
+        with self.lock:
+            return super().sample(batch_size)
+
+    def state_dict(self):
+        with self.lock:
+            return super().state_dict()
+
+    def close(self):
+        # the arrays are views on the block and have to go before it is closed
+        for name, _, _ in self._layout():
+            setattr(self, name, None)
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
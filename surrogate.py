@@ -0,0 +1,194 @@
+"""
+    Lightweight 2D stand-in for the CoppeliaSim box shaking scene.
+
+    The blocks are discs sliding on the floor of a square box. Every action
+    moves the box span metres along one axis and back in the same increments
+    as Simulation.action; the blocks lag behind the box because of their
+    inertia, lose speed to friction, bounce off the walls and push each other
+    apart. It is only an approximation of the real physics, meant for fast
+    pretraining, smoke tests and CI on machines without the simulator.
+
+    SurrogateBatch steps any number of independent scenes at once in NumPy
+    arrays, with the same step/reset interface as VectorSimulation;
+    SurrogateSimulation wraps a single scene behind the same methods
+    as Simulation so it works with get_current_state and the training loop.
+"""
+
+import numpy as np
+
+from state_engine import StateEngine, colour_labels
+
+DIRECTIONS = ['Up','Down','Right','Left']
+# axis and stroke signs of every direction number, as in Simulation.action
+AXES = np.array([1, 1, 0, 0])
+STROKES = np.array([[1, -1], [-1, 1], [1, -1], [-1, 1]])
+DONE_STATE = 15
+
+
+class SurrogateBatch():
+    def __init__(self, num_envs, blocks=18, seed=None,
+                 half_width=0.04, radius=0.008, dt=0.05, span=0.02, steps=5,
+                 coupling=0.6, damping=0.7, restitution=0.5, noise=1.0, settle_steps=3):
+        """
+            half_width: half of the inner box width, radius: block radius.
+            coupling: fraction of a box velocity change the blocks do not follow.
+            damping: velocity kept per increment (floor friction).
+            restitution: velocity kept when bouncing off a wall.
+            noise: random velocity kick relative to the box velocity change.
+        """
+        self.num_envs = num_envs
+        self.blocks = blocks
+        self.half_width = half_width
+        self.radius = radius
+        self.dt = dt
+        self.span = span
+        self.steps = steps
+        self.coupling = coupling
+        self.damping = damping
+        self.restitution = restitution
+        self.noise = noise
+        self.settle_steps = settle_steps
+        self.rng = np.random.default_rng(seed)
+        self.colours = colour_labels(blocks)
+        self.engine = StateEngine(grid=2)
+        self.box = np.zeros((num_envs, 3))
+        self.rel = np.zeros((num_envs, blocks, 2))
+        self.vel = np.zeros((num_envs, blocks, 2))
+        self.snapshot_rel = np.zeros((num_envs, blocks, 2))
+        self.snapshot_box = np.zeros((num_envs, 3))
+        self.drop(np.ones(num_envs, dtype=bool))
+
+    def drop(self, mask):
+        """Drop fresh blocks into the selected scenes, each colour on its own side."""
+        n = int(mask.sum())
+        limit = self.half_width - self.radius
+        rel = self.rng.uniform(-limit, limit, (n, self.blocks, 2))
+        # colour 0 starts on the left half of the box, colour 1 on the right
+        side = np.where(self.colours == 0, -1.0, 1.0)
+        rel[..., 0] = side * (np.abs(rel[..., 0]) * 0.9 + 0.1 * limit)
+        self.rel[mask] = rel
+        self.vel[mask] = 0.0
+        self.box[mask] = 0.0
+        self._separate()
+        self.snapshot_rel[mask] = self.rel[mask]
+        self.snapshot_box[mask] = self.box[mask]
+
+    def restore(self, mask):
+        """Put the selected scenes back to their last drop."""
+        self.rel[mask] = self.snapshot_rel[mask]
+        self.box[mask] = self.snapshot_box[mask]
+        self.vel[mask] = 0.0
+
+    def _separate(self):
+        # push overlapping blocks apart, half the overlap each
+        x = self.rel[..., 0]
+        y = self.rel[..., 1]
+        dx = x[:, :, None] - x[:, None, :]
+        dy = y[:, :, None] - y[:, None, :]
+        dist2 = dx * dx + dy * dy
+        idx = np.arange(self.blocks)
+        dist2[:, idx, idx] = np.inf
+        near = dist2 < (2 * self.radius) ** 2
+        if not near.any():
+            return
+        dist = np.sqrt(dist2, where=near, out=np.ones_like(dist2))
+        scale = np.where(near, 0.5 * (2 * self.radius - dist) / np.maximum(dist, 1e-9), 0.0)
+        self.rel[..., 0] += (scale * dx).sum(axis=2)
+        self.rel[..., 1] += (scale * dy).sum(axis=2)
+
+    def _walls(self):
+        limit = self.half_width - self.radius
+        out = np.abs(self.rel) > limit
+        self.vel = np.where(out & (self.rel * self.vel > 0), -self.restitution * self.vel, self.vel)
+        self.rel = np.clip(self.rel, -limit, limit)
+
+    def _increment(self, box_vel, new_box_vel):
+        # blocks keep part of their velocity when the box changes speed
+        dv = new_box_vel - box_vel
+        kick = self.noise * np.linalg.norm(dv, axis=-1)[:, None, None]
+        self.vel -= self.coupling * dv[:, None, :]
+        self.vel += kick * self.rng.standard_normal(self.vel.shape)
+        self.vel *= self.damping
+        self.rel += self.vel * self.dt
+        self.box[:, :2] += new_box_vel * self.dt
+        self._walls()
+        self._separate()
+
+    def step(self, directionNos):
+        """Shake every scene once; returns stacked states, rewards and dones."""
+        directionNos = np.asarray(directionNos)
+        axes = AXES[directionNos]
+        strokes = STROKES[directionNos]
+        rows = np.arange(self.num_envs)
+        box_vel = np.zeros((self.num_envs, 2))
+        for stroke in range(strokes.shape[1]):
+            new_box_vel = np.zeros((self.num_envs, 2))
+            new_box_vel[rows, axes] = strokes[:, stroke] * self.span / self.steps / self.dt
+            for _ in range(self.steps):
+                self._increment(box_vel, new_box_vel)
+                box_vel = new_box_vel
+        still = np.zeros((self.num_envs, 2))
+        for _ in range(self.settle_steps):
+            self._increment(box_vel, still)
+            box_vel = still
+        return self.evaluate()
+
+    def positions(self):
+        """World xy positions of all blocks, shape (num_envs, blocks, 2)."""
+        return self.rel + self.box[:, None, :2]
+
+    def evaluate(self):
+        states, rewards, counts = self.engine.evaluate(self.box, self.positions(), self.colours)
+        return states, rewards, states == DONE_STATE
+
+    def reset(self, mask=None, rebuild=False):
+        mask = np.ones(self.num_envs, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        if rebuild:
+            self.drop(mask)
+        else:
+            self.restore(mask)
+        return self.evaluate()[0]
+
+    def close(self):
+        pass
+
+
+class SurrogateSimulation():
+    def __init__(self, sim_port = None, server_step = False, seed = None, **kwargs):
+        # sim_port and server_step are accepted for drop-in use and ignored
+        self.directions = ['Up','Down','Left','Right']
+        self.batch = SurrogateBatch(1, seed=seed, **kwargs)
+        self.blocks = self.batch.blocks
+        self.colours = self.batch.colours
+
+    def reset(self, rebuild=False):
+        self.batch.reset(rebuild=rebuild)
+
+    def action(self,direction=None):
+        if direction not in self.directions:
+            print(f'Direction: {direction} invalid, please choose one from {self.directions}')
+            return
+        self.batch.step([self.getDirectionNo(direction)])
+
+    def getPositions(self):
+        return self.getBoxPosition(), self.getObjectsPositions()
+
+    def getObjectsPositions(self):
+        return self.batch.positions()[0].tolist()
+
+    def getBoxPosition(self):
+        return self.batch.box[0].tolist()
+
+    def getDirectionNo(self,direction):
+        return DIRECTIONS.index(direction)
+
+    def getDirection(self,directionNo):
+        return DIRECTIONS[directionNo]
+
+    def stepSim(self, n=1):
+        still = np.zeros((1, 2))
+        for _ in range(n):
+            self.batch._increment(still, still)
+
+    def stopSim(self):
+        pass
@@ -0,0 +1,274 @@
+"""
+    Hyperparameter sweeps over a pool of simulators.
+
+    Every trial is one call of exec_environment.train with some of its
+    arguments overridden. One worker process per simulator port (or per
+    surrogate slot) takes the next trial as soon as its previous one ends, so
+    every simulator stays busy. Trials report their recent mean episode
+    reward every REPORT_EVERY episodes; after WARMUP_EPISODES, a trial whose
+    value is below the median of the other trials at the same episode is
+    pruned. Trial outputs go to <out>/trial-NNNN/ and all final metrics to
+    <out>/results.csv.
+
+    The search space is a JSON object mapping train() arguments to a list of
+    values, or, for random search, to {"uniform": [lo, hi]},
+    {"log_uniform": [lo, hi]} or {"int": [lo, hi]}:
+
+    python3 sweep.py --space '{"lr": [0.01, 0.1, 0.4], "gamma": [0.85, 0.95]}' --ports 23000 23002
+    python3 sweep.py --space space.json --random 20 --surrogate --workers 8
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
+import time
+import traceback
+
+import numpy as np
+
+from vector_env import CLOSE_TIMEOUT
+
+REPORT_EVERY = 10
+WARMUP_EPISODES = 20
+# reports needed from other trials at an episode before pruning against them
+MIN_TRIALS = 3
+WINDOW = 10
+SWEEP_DIR = 'sweep'
+
+
+def grid(space):
+    """Every combination of the value lists in space."""
+    names = sorted(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def sample(space, rng):
+    params = {}
+    for name, spec in sorted(space.items()):
+        if isinstance(spec, list):
+            params[name] = spec[rng.randrange(len(spec))]
+        elif 'uniform' in spec:
+            params[name] = rng.uniform(*spec['uniform'])
+        elif 'log_uniform' in spec:
+            low, high = spec['log_uniform']
+            params[name] = math.exp(rng.uniform(math.log(low), math.log(high)))
+        elif 'int' in spec:
+            params[name] = rng.randint(*spec['int'])
+        else:
+            raise ValueError(f'unknown distribution for {name}: {spec}')
+    return params
+
+
+def trials(space, samples=None, seed=None):
+    """Grid search, or samples random draws when samples is set."""
+    if samples is None:
+        return list(grid(space))
+    rng = random.Random(seed)
+    return [sample(space, rng) for _ in range(samples)]
+
+
+def _worker(conn, sim_port, surrogate):
+    import torch
+    from exec_environment import train
+    # trials run side by side, one core each
+    torch.set_num_threads(1)
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == 'close':
+            break
+        trial_id, params, directory, seed = arg
+        rewards = []
+        closing = False
+
+        def on_episode(episode, steps, reward, epsilon):
+            nonlocal closing
+            rewards.append(reward)
+            if len(rewards) % REPORT_EVERY:
+                return False
+            conn.send(('report', (trial_id, len(rewards), float(np.mean(rewards[-WINDOW:])))))
+            reply = conn.recv()
+            # the sweep was closed while this trial ran: stop it and exit
+            closing = reply == ('close', None)
+            return closing or reply == 'prune'
+
+        try:
+            random.seed(seed)
+            np.random.seed(seed % 2**32)
+            torch.manual_seed(seed)
+            os.makedirs(directory, exist_ok=True)
+            start = time.perf_counter()
+            result = train(**params, surrogate=surrogate, sim_port=sim_port, seed=seed, resume=False, checkpoint_dir='',
+                           metrics_file=os.path.join(directory, 'trainingLogs.jsonl'),
+                           model_file=os.path.join(directory, 'model'),
+                           policy_file=os.path.join(directory, 'model_policy.npz'),
+                           on_episode=on_episode)
+            result['seconds'] = time.perf_counter() - start
+            if closing:
+                break
+            conn.send(('done', (trial_id, result)))
+        except Exception:
+            conn.send(('error', (trial_id, traceback.format_exc())))
+
+
+class MedianPruner():
+    """Prune a trial whose value is below the median of the others at the same episode."""
+
+    def __init__(self, warmup=WARMUP_EPISODES, min_trials=MIN_TRIALS):
+        self.warmup = warmup
+        self.min_trials = min_trials
+        # episode -> {trial_id: value}
+        self.values = {}
+
+    def report(self, trial_id, episode, value):
+        """Record a report and return whether the trial should stop."""
+        others = [v for t, v in self.values.get(episode, {}).items() if t != trial_id]
+        self.values.setdefault(episode, {})[trial_id] = value
+        if episode < self.warmup or len(others) < self.min_trials:
+            return False
+        return value < np.median(others)
+
+
+class Sweep():
+    def __init__(self, ports=(23000,), surrogate=False, workers=None, directory=SWEEP_DIR, pruner=None):
+        """One worker per port, or workers surrogate slots."""
+        self.directory = directory
+        self.pruner = MedianPruner() if pruner is None else pruner
+        count = (workers or os.cpu_count()) if surrogate else len(ports)
+        ctx = multiprocessing.get_context('spawn')
+        self.conns = []
+        self.processes = []
+        for i in range(count):
+            parent, child = ctx.Pipe()
+            port = 23000 if surrogate else ports[i]
+            process = ctx.Process(target=_worker, args=(child, port, surrogate), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        try:
+            self.close()
+        except Exception:
+            if excType is None:
+                raise
+            # the error that ended the sweep is the one to report
+            traceback.print_exc()
+
+    def run(self, params_list, seed=0):
+        """Run every parameter set; returns one row per trial, in trial order."""
+        pending = list(enumerate(params_list))
+        rows = {}
+        running = {}
+        pruned = set()
+        idle = list(self.conns)
+        while pending or running:
+            while pending and idle:
+                trial_id, params = pending.pop(0)
+                conn = idle.pop()
+                directory = os.path.join(self.directory, f'trial-{trial_id:04d}')
+                conn.send(('trial', (trial_id, params, directory, seed + trial_id)))
+                running[conn] = trial_id
+                print(f'trial {trial_id} started: {params}')
+            for conn in multiprocessing.connection.wait(list(running)):
+                kind, value = conn.recv()
+                if kind == 'report':
+                    trial_id, episode, reward = value
+                    prune = self.pruner.report(trial_id, episode, reward)
+                    if prune:
+                        pruned.add(trial_id)
+                    conn.send('prune' if prune else 'continue')
+                    continue
+                trial_id = running.pop(conn)
+                idle.append(conn)
+                row = {'trial': trial_id, **params_list[trial_id]}
+                if kind == 'error':
+                    row['status'] = 'failed'
+                    print(f'trial {trial_id} failed:\n{value[1]}')
+                else:
+                    row['status'] = 'pruned' if trial_id in pruned else 'complete'
+                    row.update(value[1])
+                    print(f'trial {trial_id} {row["status"]}: mean reward {row["mean_reward"]}, solve rate {row["solve_rate"]}')
+                rows[trial_id] = row
+        return [rows[trial_id] for trial_id in sorted(rows)]
+
+    def close(self):
+        # workers that already died are only reaped, hung ones are terminated
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(('close', None))
+                except (BrokenPipeError, EOFError, OSError):
+                    pass
+        for conn, process in zip(self.conns, self.processes):
+            process.join(timeout=CLOSE_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            conn.close()
+        self.conns = []
+        self.processes = []
+
+
+def write_results(rows, path):
+    """Write the rows as CSV, with the union of their keys as columns."""
+    columns = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_table(rows):
+    """Trials with the best final mean reward first."""
+    ranked = sorted(rows, key=lambda row: -math.inf if row.get('mean_reward') is None else row['mean_reward'], reverse=True)
+    columns = []
+    for row in ranked:
+        columns.extend(key for key in row if key not in columns)
+    cells = [[f'{row[c]:.4g}' if isinstance(row.get(c), float) else str(row.get(c, '')) for c in columns] for row in ranked]
+    widths = [max(len(c), *(len(line[k]) for line in cells)) for k, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for line in cells:
+        print('  '.join(cell.ljust(w) for cell, w in zip(line, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a hyperparameter sweep of train() over a simulator pool.')
+    parser.add_argument('--space', required=True, help='JSON search space, or a file holding it')
+    parser.add_argument('--random', type=int, metavar='N', help='random search with N trials instead of the grid')
+    parser.add_argument('--ports', type=int, nargs='+', default=[23000])
+    parser.add_argument('--surrogate', action='store_true', help='train on surrogate scenes instead of CoppeliaSim')
+    parser.add_argument('--workers', type=int, help='surrogate worker processes, default one per CPU')
+    parser.add_argument('--out', default=SWEEP_DIR)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-prune', action='store_true')
+    args = parser.parse_args()
+
+    if os.path.exists(args.space):
+        with open(args.space) as f:
+            space = json.load(f)
+    else:
+        space = json.loads(args.space)
+    params_list = trials(space, args.random, args.seed)
+    pruner = MedianPruner(warmup=math.inf) if args.no_prune else None
+    with Sweep(args.ports, args.surrogate, args.workers, args.out, pruner) as sweep:
+        rows = sweep.run(params_list, args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    write_results(rows, os.path.join(args.out, 'results.csv'))
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""Stop rule of the actor/learner loop."""
+
+import json
+import os
+
+from actor_learner import train_actor_learner
+
+
+def test_learner_catches_up_with_the_replay_ratio(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shm = set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else None
+    updates = train_actor_learner(actors=2, surrogate=True, episodes=4, replay_ratio=2.0, resume=False)
+    with open('trainingLogs.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    transitions = sum(r['steps'] for r in records if r['kind'] == 'episode')
+    assert updates >= 2.0 * transitions
+    assert updates < 2.0 * transitions + 1
+    if shm is not None:
+        assert set(os.listdir('/dev/shm')) <= shm
@@ -0,0 +1,37 @@
+"""Connections handed back to the pool must still be usable by the next client."""
+
+import gc
+
+from zmqRemoteApi import RemoteAPIClient
+from zmqRemoteApi.connection import ConnectionManager
+from zmqRemoteApi.server import CONSTS, RemoteAPIServer
+
+PORT = 24300
+
+
+def test_collected_client_does_not_poison_the_pool():
+    server = RemoteAPIServer(port=PORT)
+    server.start()
+    manager = ConnectionManager()
+    try:
+        client = RemoteAPIClient(port=PORT, manager=manager)
+        client.getObject('sim')
+        # client.sim refers back to the client, so only the cycle collector frees it
+        del client
+        gc.collect()
+        client = RemoteAPIClient(port=PORT, manager=manager)
+        assert client.call('sim.getSimulationState', []) == CONSTS['simulation_stopped']
+        client.close()
+    finally:
+        manager.closeAll()
+        server.stop()
+
+
+def test_release_drops_closed_connections():
+    manager = ConnectionManager()
+    connection = manager.acquire('127.0.0.1', PORT + 10, PORT + 11)
+    connection.socket.close()
+    manager.release(connection)
+    assert not manager.idle.get(connection.key)
+    assert manager.acquire('127.0.0.1', PORT + 10, PORT + 11) is not connection
+    manager.closeAll()
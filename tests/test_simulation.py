@@ -0,0 +1,37 @@
+"""Simulation against the stand-in server."""
+
+import pytest
+
+import exec_environment
+from exec_environment import Simulation
+from zmqRemoteApi.server import RemoteAPIServer
+
+PORT = 24400
+
+
+def test_server_step_stays_enabled():
+    server = RemoteAPIServer(port=PORT).start()
+    try:
+        env = Simulation(sim_port=PORT, server_step=True)
+        env.action('Up')
+        # a failed server step would have fallen back to client stepping
+        assert env.server_step
+        box_position, positions = env.lastPositions
+        assert len(box_position) == 3 and len(positions) == len(env.object_shapes_handles)
+        env.stopSim()
+    finally:
+        server.stop()
+
+
+def test_rebuild_gives_up_on_a_simulation_that_does_not_stop(monkeypatch):
+    server = RemoteAPIServer(port=PORT + 10).start()
+    try:
+        env = Simulation(sim_port=PORT + 10)
+        env.reset(rebuild=True)
+        server.functions['sim.stopSimulation'] = lambda: None
+        monkeypatch.setattr(exec_environment, 'STOP_TIMEOUT', 0.1)
+        with pytest.raises(TimeoutError):
+            env.reset(rebuild=True)
+        env.client.close()
+    finally:
+        server.stop()
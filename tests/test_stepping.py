@@ -0,0 +1,34 @@
+"""step(n) against a server without stepUntil, like CoppeliaSim's add-on."""
+
+import asyncio
+
+from zmqRemoteApi.asyncio import RemoteAPIClient
+from zmqRemoteApi.server import RemoteAPIServer
+
+PORT = 24500
+
+
+def test_async_step_does_not_probe_step_until():
+    server = RemoteAPIServer(port=PORT)
+    del server.functions['stepUntil']
+    calls = []
+    step = server.functions['step']
+    server.functions['step'] = lambda *args: calls.append('step') or step(*args)
+    server.start()
+
+    async def run():
+        async with RemoteAPIClient(port=PORT) as client:
+            sim = await client.getObject('sim')
+            await client.setStepping(True)
+            await sim.startSimulation()
+            await client.step(5)
+            await sim.stopSimulation()
+            return client.stepUntilSupported
+
+    try:
+        supported = asyncio.run(run())
+    finally:
+        server.stop()
+    assert calls == ['step'] * 5
+    # a failed stepUntil probe would have cleared it to False
+    assert supported is None
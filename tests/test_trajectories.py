@@ -0,0 +1,51 @@
+"""Round trip of a trajectory store."""
+
+import mmap
+
+import numpy as np
+import pytest
+
+from trajectories import TrajectoryReader, TrajectoryRecorder
+
+
+def record(directory, compression=None, episodes=3, steps=5):
+    kwargs = {} if compression is None else {'compression': compression}
+    with TrajectoryRecorder(str(directory), blocks=2, colours=[0, 1], chunk_steps=4, **kwargs) as recorder:
+        for episode in range(episodes):
+            for step in range(steps):
+                recorder.recordStep(None if step == 0 else step % 4, [episode, step, 0.0], [[1.0, 2.0, 0.0], [3.0, 4.0, 0.0]],
+                                    -1.0, step)
+            recorder.endEpisode(episode)
+
+
+def mapped(array):
+    while isinstance(array, (np.ndarray, memoryview)):
+        array = array.base if isinstance(array, np.ndarray) else array.obj
+    return isinstance(array, mmap.mmap)
+
+
+def test_default_store_is_read_without_copying(tmp_path):
+    record(tmp_path)
+    with TrajectoryReader(str(tmp_path)) as reader:
+        assert reader.meta['compression'] == 'none'
+        rows = reader.steps(0, 4)
+        assert mapped(rows)
+        assert list(reader.episodeNumbers) == [0, 1, 2]
+        assert list(reader.episode(1)['box'][:, 1]) == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma'])
+def test_compressed_store_matches_raw(tmp_path, compression):
+    record(tmp_path / 'raw')
+    record(tmp_path / compression, compression)
+    with TrajectoryReader(str(tmp_path / 'raw')) as raw, TrajectoryReader(str(tmp_path / compression)) as packed:
+        assert np.array_equal(raw.steps(), packed.steps())
+        assert not mapped(packed.steps(0, 4))
+
+
+def test_discard_after(tmp_path):
+    record(tmp_path)
+    with TrajectoryRecorder(str(tmp_path), blocks=2) as recorder:
+        recorder.discardAfter(0)
+    with TrajectoryReader(str(tmp_path)) as reader:
+        assert len(reader) == 1 and reader.rows == 5
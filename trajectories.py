@@ -0,0 +1,349 @@
+"""
+    Compact on-disk record of simulator rollouts.
+
+    Every observation of an episode is one float32 row: the action that led
+    to it (-1 for the first observation of an episode), the reward and state
+    it was given, the box position and the x, y position of every block.
+    Rewards and states can therefore be recomputed later with another
+    StateEngine, and consecutive rows of an episode are transitions for
+    offline training.
+
+    A store is a directory:
+        meta.json       layout, block colours, chunk size and compression
+        steps.bin       the rows, written a chunk at a time
+        chunks.bin      int64 (offset, bytes, rows) of every chunk in steps.bin
+        episodes.bin    int64 (first row, rows, episode number or -1) of every
+                        finished episode
+
+    A chunk is only listed in chunks.bin once its data is written, and an
+    episode only once all its rows are, so after a crash the store ends at
+    the last complete chunk. By default steps.bin is one plain float32 array
+    that TrajectoryReader maps into memory and reads without copying; with
+    compression='zlib' or 'lzma' every chunk is compressed on its own, after
+    shuffling the bytes of the floats, and decompressed when read, trading
+    the zero-copy reads for a smaller store. A training run resumed from a
+    checkpoint first drops the episodes recorded after it with discardAfter.
+
+    python3 trajectories.py trajectories
+"""
+
+import argparse
+import json
+import lzma
+import mmap
+import os
+import zlib
+
+import numpy as np
+
+from vector_env import DONE_STATE
+
+CHUNK_STEPS = 4096
+# 'zlib' or 'lzma' shrink the store, but every read then decompresses a chunk
+COMPRESSION = 'none'
+COMPRESSORS = {
+    'none': (None, None),
+    'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+NO_ACTION = -1
+FORMAT_VERSION = 2
+
+
+def layout(blocks):
+    """Column name -> (start, stop) in a row for a scene with that many blocks."""
+    return {'action': (0, 1), 'reward': (1, 2), 'state': (2, 3), 'box': (3, 6), 'blocks': (6, 6 + 2 * blocks)}
+
+
+def _shuffle(rows):
+    # all first bytes of the floats, then all second bytes, ... compresses far better
+    return np.ascontiguousarray(rows.view(np.uint8).reshape(-1, 4).T).tobytes()
+
+
+def _unshuffle(data, width):
+    return np.frombuffer(data, dtype=np.uint8).reshape(4, -1).T.copy().view(np.float32).reshape(-1, width)
+
+
+def _decode(data, compression, width):
+    if compression == 'none':
+        return np.frombuffer(data, dtype=np.float32).reshape(-1, width)
+    return _unshuffle(COMPRESSORS[compression][1](data), width)
+
+
+def _readIndex(path, columns):
+    try:
+        values = np.fromfile(path, dtype=np.int64)
+    except FileNotFoundError:
+        return np.zeros((0, columns), dtype=np.int64)
+    # a record cut short by a crash is ignored
+    return values[:len(values) // columns * columns].reshape(-1, columns)
+
+
+class TrajectoryRecorder():
+    def __init__(self, directory, blocks, colours=None, chunk_steps=CHUNK_STEPS, compression=COMPRESSION):
+        """
+            Append rollouts to the store in directory, creating it if needed.
+            An existing store is continued and keeps its own chunk size and
+            compression.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        metaPath = os.path.join(directory, 'meta.json')
+        if os.path.exists(metaPath):
+            with open(metaPath) as f:
+                self.meta = json.load(f)
+            if self.meta['blocks'] != blocks:
+                raise ValueError(f'{directory} holds scenes with {self.meta["blocks"]} blocks, not {blocks}')
+            if self.meta['version'] != FORMAT_VERSION:
+                raise ValueError(f'{directory} has format version {self.meta["version"]}, only {FORMAT_VERSION} can be appended to')
+        else:
+            if compression not in COMPRESSORS:
+                raise ValueError(f'unknown compression {compression}, use one of {sorted(COMPRESSORS)}')
+            self.meta = {'version': FORMAT_VERSION, 'blocks': blocks, 'width': layout(blocks)['blocks'][1],
+                         'columns': layout(blocks), 'chunk_steps': chunk_steps, 'compression': compression,
+                         'colours': None if colours is None else [int(c) for c in colours]}
+            tmp = metaPath + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.meta, f, indent=2)
+            os.replace(tmp, metaPath)
+        self.width = self.meta['width']
+        self.compress = COMPRESSORS[self.meta['compression']][0]
+
+        chunks = _readIndex(os.path.join(directory, 'chunks.bin'), 3)
+        self.offset = int(chunks[-1, 0] + chunks[-1, 1]) if len(chunks) else 0
+        self.rows = int(chunks[:, 2].sum())
+        # drop whatever a crash left after the last complete chunk and episode
+        self.dataFile = open(os.path.join(directory, 'steps.bin'), 'ab')
+        self.dataFile.truncate(self.offset)
+        self.chunkFile = open(os.path.join(directory, 'chunks.bin'), 'ab')
+        self.chunkFile.truncate(len(chunks) * 3 * 8)
+        episodes = _readIndex(os.path.join(directory, 'episodes.bin'), 3)
+        complete = int((episodes[:, 0] + episodes[:, 1] <= self.rows).sum())
+        self.episodeFile = open(os.path.join(directory, 'episodes.bin'), 'ab')
+        self.episodeFile.truncate(complete * 3 * 8)
+        self.episodes = complete
+
+        self.buffer = np.empty((self.meta['chunk_steps'], self.width), dtype=np.float32)
+        self.buffered = 0
+        self.episodeStart = None
+        # (first row, rows, episode) of finished episodes whose rows are not all written
+        self.pendingEpisodes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def recordStep(self, action, box_position, positions, reward, state):
+        """Add one observation; action is None for the first one of an episode."""
+        if self.episodeStart is None:
+            self.episodeStart = self.rows + self.buffered
+        row = self.buffer[self.buffered]
+        row[0] = NO_ACTION if action is None else action
+        row[1] = reward
+        row[2] = state
+        row[3:6] = box_position[:3]
+        row[6:] = np.asarray(positions, dtype=np.float32)[:, :2].ravel()
+        self.buffered += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def endEpisode(self, episode=None):
+        """Close the current episode; episode is its number in the training run, if any."""
+        if self.episodeStart is None:
+            return
+        end = self.rows + self.buffered
+        self.pendingEpisodes.append((self.episodeStart, end - self.episodeStart, -1 if episode is None else episode))
+        self.episodeStart = None
+
+    def flush(self):
+        """Write the buffered rows as a chunk, and the episodes they complete."""
+        if self.buffered:
+            rows = self.buffer[:self.buffered]
+            data = rows.tobytes() if self.compress is None else self.compress(_shuffle(rows))
+            self.dataFile.write(data)
+            self.dataFile.flush()
+            self.chunkFile.write(np.array([self.offset, len(data), self.buffered], dtype=np.int64).tobytes())
+            self.chunkFile.flush()
+            self.offset += len(data)
+            self.rows += self.buffered
+            self.buffered = 0
+        done = [episode for episode in self.pendingEpisodes if episode[0] + episode[1] <= self.rows]
+        if done:
+            self.episodeFile.write(np.array(done, dtype=np.int64).tobytes())
+            self.episodeFile.flush()
+            self.episodes += len(done)
+            self.pendingEpisodes = self.pendingEpisodes[len(done):]
+
+    def discardAfter(self, episode):
+        """
+            Drop the episodes from the first one numbered after episode on,
+            and their rows, e.g. when training resumes from the checkpoint of
+            that episode. Rows of an unfinished episode go too.
+        """
+        self.episodeStart = None
+        self.flush()
+        episodes = _readIndex(os.path.join(self.directory, 'episodes.bin'), 3)[:self.episodes]
+        keep = 0
+        while keep < len(episodes) and episodes[keep, 2] <= episode:
+            keep += 1
+        cut = int(episodes[keep - 1, 0] + episodes[keep - 1, 1]) if keep else 0
+        self.episodeFile.truncate(keep * 3 * 8)
+        self.episodes = keep
+        if cut == self.rows:
+            return
+        chunks = _readIndex(os.path.join(self.directory, 'chunks.bin'), 3)
+        starts = np.concatenate([[0], np.cumsum(chunks[:, 2])])
+        index = int(np.searchsorted(starts, cut, side='right')) - 1
+        offset, nbytes, rows = (int(v) for v in chunks[index])
+        with open(os.path.join(self.directory, 'steps.bin'), 'rb') as f:
+            f.seek(offset)
+            kept = _decode(f.read(nbytes), self.meta['compression'], self.width)[:cut - int(starts[index])]
+        # the chunk holding the cut is written again with only the rows before it
+        self.dataFile.truncate(offset)
+        self.chunkFile.truncate(index * 3 * 8)
+        self.offset = offset
+        self.rows = int(starts[index])
+        self.buffer[:len(kept)] = kept
+        self.buffered = len(kept)
+        self.flush()
+
+    def close(self):
+        # an episode still open is kept as far as it got
+        self.endEpisode()
+        self.flush()
+        self.dataFile.close()
+        self.chunkFile.close()
+        self.episodeFile.close()
+
+
+class TrajectoryReader():
+    """Memory mapped access to a store written by TrajectoryRecorder."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != FORMAT_VERSION:
+            raise ValueError(f'unsupported trajectory store version {self.meta["version"]}')
+        self.width = self.meta['width']
+        self.columns = {name: tuple(span) for name, span in self.meta['columns'].items()}
+        self.colours = None if self.meta['colours'] is None else np.array(self.meta['colours'])
+        self.decompress = COMPRESSORS[self.meta['compression']][1]
+        self.chunks = _readIndex(os.path.join(directory, 'chunks.bin'), 3)
+        # first row of every chunk, and the total at the end
+        self.chunkRows = np.concatenate([[0], np.cumsum(self.chunks[:, 2])])
+        self.rows = int(self.chunkRows[-1])
+        episodes = _readIndex(os.path.join(directory, 'episodes.bin'), 3)
+        episodes = episodes[episodes[:, 0] + episodes[:, 1] <= self.rows]
+        # (first row, rows) of every episode and its number in the training run, -1 if unknown
+        self.episodes = episodes[:, :2]
+        self.episodeNumbers = episodes[:, 2]
+        self.file = open(os.path.join(directory, 'steps.bin'), 'rb')
+        size = int(self.chunks[-1, 0] + self.chunks[-1, 1]) if len(self.chunks) else 0
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        self.cached = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def chunk(self, index):
+        """Rows of one chunk; a view of the mapped file when uncompressed."""
+        if self.cached[0] == index:
+            return self.cached[1]
+        offset, nbytes, rows = (int(v) for v in self.chunks[index])
+        if self.decompress is None:
+            data = np.frombuffer(self.map, dtype=np.float32, count=rows * self.width, offset=offset).reshape(rows, self.width)
+        else:
+            data = _decode(self.map[offset:offset + nbytes], self.meta['compression'], self.width)
+        self.cached = (index, data)
+        return data
+
+    def steps(self, start=0, stop=None):
+        """Rows start to stop of the whole store, without copying if they lie in one uncompressed chunk."""
+        stop = self.rows if stop is None else min(stop, self.rows)
+        if start >= stop:
+            return np.zeros((0, self.width), dtype=np.float32)
+        first = int(np.searchsorted(self.chunkRows, start, side='right')) - 1
+        last = int(np.searchsorted(self.chunkRows, stop, side='left')) - 1
+        parts = [self.chunk(index) for index in range(first, last + 1)]
+        data = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        base = int(self.chunkRows[first])
+        return data[start - base:stop - base]
+
+    def split(self, rows):
+        """Column name -> array for some rows; blocks are shaped (rows, blocks, 2)."""
+        columns = {name: rows[:, a:b] for name, (a, b) in self.columns.items()}
+        for name in ('action', 'state'):
+            columns[name] = columns[name][:, 0].astype(np.int64)
+        columns['reward'] = columns['reward'][:, 0]
+        columns['blocks'] = columns['blocks'].reshape(len(rows), -1, 2)
+        return columns
+
+    def episode(self, index):
+        """Columns of one episode, its first observation included."""
+        start, rows = (int(v) for v in self.episodes[index])
+        return self.split(self.steps(start, start + rows))
+
+    def transitions(self, start=0, stop=None):
+        """
+            Consecutive observations of the episodes start to stop as
+            observation columns, 'next_' columns for the observation after the
+            action, and the action itself.
+        """
+        current, following = [], []
+        for start_row, rows in self.episodes[start:stop]:
+            data = self.steps(int(start_row), int(start_row + rows))
+            current.append(data[:-1])
+            following.append(data[1:])
+        if not current:
+            empty = np.zeros((0, self.width), dtype=np.float32)
+            current, following = [empty], [empty]
+        before = self.split(np.concatenate(current))
+        after = self.split(np.concatenate(following))
+        result = {'action': after.pop('action')}
+        del before['action']
+        result.update(before)
+        result.update({'next_' + name: values for name, values in after.items()})
+        return result
+
+    def relabel(self, engine, start=0, stop=None):
+        """States and rewards of every row from start to stop recomputed with another StateEngine."""
+        if self.colours is None:
+            raise ValueError(f'{self.directory} was recorded without block colours')
+        columns = self.split(self.steps(start, stop))
+        state, reward, counts = engine.evaluate(columns['box'], columns['blocks'], self.colours)
+        return state, reward
+
+    def close(self):
+        # arrays handed out keep the mapping alive, it is unmapped with the last of them
+        self.cached = (None, None)
+        self.map = None
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a trajectory store.')
+    parser.add_argument('directory')
+    args = parser.parse_args()
+    with TrajectoryReader(args.directory) as reader:
+        size = sum(os.path.getsize(os.path.join(args.directory, name))
+                   for name in ('steps.bin', 'chunks.bin', 'episodes.bin', 'meta.json'))
+        lengths = reader.episodes[:, 1] - 1
+        print(f'{len(reader)} episodes, {reader.rows} observations of {reader.meta["blocks"]} blocks, '
+              f'{len(reader.chunks)} chunks ({reader.meta["compression"]}), {size / 1e6:.2f} MB on disk, '
+              f'{size / max(reader.rows, 1):.1f} bytes per observation')
+        if len(reader):
+            solved = sum(reader.episode(i)['state'][-1] == DONE_STATE for i in range(len(reader)))
+            print(f'actions per episode: mean {lengths.mean():.1f}, max {lengths.max()}; {solved} solved')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+    Runs several CoppeliaSim instances side by side, one worker process each.
+
+    Start one simulator per port, e.g. for four instances:
+    ./coppeliaSim.sh -GzmqRemoteApi.rpcPort=23000 mix_intro_AI.ttt
+    ./coppeliaSim.sh -GzmqRemoteApi.rpcPort=23002 mix_intro_AI.ttt
+    ...
+    Every instance also uses port+1 for its step counter, so consecutive
+    instances are spaced PORT_STRIDE ports apart. train(num_envs=4) in
+    exec_environment.py trains on them together.
+"""
+
+import multiprocessing
+import traceback
+
+import numpy as np
+
+PORT_STRIDE = 2
+DONE_STATE = 15
+# seconds a worker gets to stop its simulator before it is terminated
+CLOSE_TIMEOUT = 30
+
+
+def _worker(conn, sim_port, server_step):
+    # imported here so the parent only pays for torch once
+    from exec_environment import Simulation, get_current_state
+    env = None
+    try:
+        env = Simulation(sim_port=sim_port, server_step=server_step)
+        conn.send(('ok', get_current_state(env)))
+        while True:
+            cmd, arg = conn.recv()
+            if cmd == 'step':
+                env.action(env.getDirection(arg))
+                state, reward = get_current_state(env)
+                conn.send(('ok', (state, reward, state == DONE_STATE)))
+            elif cmd == 'reset':
+                env.reset(rebuild=arg)
+                conn.send(('ok', get_current_state(env)))
+            elif cmd == 'close':
+                env.stopSim()
+                conn.send(('ok', None))
+                break
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class VectorSimulation():
+    def __init__(self, num_envs, base_port=23000, server_step=False):
+        self.num_envs = num_envs
+        self.ports = [base_port + PORT_STRIDE * i for i in range(num_envs)]
+        ctx = multiprocessing.get_context('spawn')
+        self.conns = []
+        self.processes = []
+        for port in self.ports:
+            parent, child = ctx.Pipe()
+            process = ctx.Process(target=_worker, args=(child, port, server_step), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+        self.states, _ = self._gather(self.conns)
+
+    def _gather(self, conns):
+        results = []
+        for conn in conns:
+            status, value = conn.recv()
+            if status == 'error':
+                raise RuntimeError(f'simulator worker failed:\n{value}')
+            results.append(value)
+        return tuple(np.array(column) for column in zip(*results))
+
+    def step(self, directionNos):
+        """Run one action in every simulator; returns stacked states, rewards and dones."""
+        for conn, directionNo in zip(self.conns, directionNos):
+            conn.send(('step', int(directionNo)))
+        self.states, rewards, dones = self._gather(self.conns)
+        return self.states, rewards, dones
+
+    def reset(self, mask=None, rebuild=False):
+        """Reset the simulators selected by the boolean mask (all by default)."""
+        indices = range(self.num_envs) if mask is None else np.flatnonzero(mask)
+        conns = [self.conns[i] for i in indices]
+        for conn in conns:
+            conn.send(('reset', rebuild))
+        if conns:
+            states, _ = self._gather(conns)
+            self.states = self.states.copy()
+            self.states[list(indices)] = states
+        return self.states
+
+    def close(self):
+        # workers that already died, e.g. after an error, are only reaped
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(('close', None))
+                except (BrokenPipeError, EOFError, OSError):
+                    pass
+        for conn, process in zip(self.conns, self.processes):
+            try:
+                if process.is_alive() and conn.poll(CLOSE_TIMEOUT):
+                    conn.recv()
+            except (EOFError, OSError):
+                pass
+            process.join(timeout=CLOSE_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            conn.close()
+
+
+def select_directions(network, states, epsilon):
+    """Epsilon-greedy directions for all simulators from one batched forward pass; epsilon may be per simulator."""
+    directions = network.actBatch(states)
+    explore = np.random.random(len(states)) < epsilon
+    directions[explore] = np.random.randint(4, size=explore.sum())
+    return directions
@@ -4,56 +4,146 @@ import os
 
 import uuid
 
-from time import sleep
-
-import cbor
+from time import monotonic, perf_counter, sleep
 
 import zmq
 
 import math
 
+from .codec import getCodec
+from .connection import defaultManager, defaultTimeout
+from .profiler import getProfiler
+from .schema import RemoteObject, SchemaCache, defaultCacheDir, versionCalls
+from .stepping import (finished, remainingCondition, signalGetters, signalMet, signalValue,
+                       stepsFor, unknownFunction, untilCondition)
+
 def b64(b):
     import base64
     return base64.b64encode(b).decode('ascii')
 
 
+class RemoteAPIBatch:
+    """Calls queued with call() are sent together when the block exits."""
+
+    def __init__(self, client, *, returnExceptions=False):
+        self.client = client
+        self.returnExceptions = returnExceptions
+        self.calls = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if excType is None:
+            self.results = self.client.callMany(self.calls, returnExceptions=self.returnExceptions)
+
+    def __getitem__(self, index):
+        if self.results is None:
+            raise RuntimeError('batch has not been sent yet')
+        return self.results[index]
+
+    def call(self, func, args):
+        """Queue a call and return its index in the results."""
+        self.calls.append((func, args))
+        return len(self.calls) - 1
+
+
 class RemoteAPIClient:
     """Client to connect to CoppeliaSim's ZMQ Remote API."""
 
-    def __init__(self, host='localhost', port=23000, cntport=None, *, verbose=None):
-        """Create client and connect to the ZMQ Remote API server."""
+    def __init__(self, host='localhost', port=23000, cntport=None, *, verbose=None, cacheDir=None, codec=None, profile=None, timeout=None, manager=None):
+        """Create client and connect to the ZMQ Remote API server.
+
+        Schemas returned by zmqRemoteApi.info are cached in cacheDir (see
+        schema.defaultCacheDir); pass cacheDir='' to always query the server.
+        codec is a codec name or instance, see codec.getCodec. profile is
+        True, False or a CallProfiler, see profiler.getProfiler; with a
+        profiler, self.profiler.snapshot() returns the call statistics.
+
+        Sockets are borrowed from manager (connection.defaultManager() by
+        default) and handed back by close(). With a timeout in seconds
+        (default $ZMQREMOTEAPI_TIMEOUT), a server that does not answer raises
+        TimeoutError and the sockets are reconnected.
+        """
         self.verbose = int(os.environ.get('VERBOSE', '0')) if verbose is None else verbose
-        self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REQ)
-        self.cntsocket = self.context.socket(zmq.SUB)
-        self.socket.connect(f'tcp://{host}:{port}')
-        self.cntsocket.setsockopt(zmq.SUBSCRIBE, b'')
-        self.cntsocket.setsockopt(zmq.CONFLATE, 1)
-        self.cntsocket.connect(f'tcp://{host}:{cntport if cntport else port+1}')
+        self.codec = getCodec(codec)
+        self.profiler = getProfiler(profile)
+        cacheDir = defaultCacheDir() if cacheDir is None else cacheDir
+        self.schemaCache = SchemaCache(cacheDir) if cacheDir else None
+        self.serverVersion = None
+        self.manager = manager or defaultManager()
+        self.connection = self.manager.acquire(host, port, cntport if cntport else port+1,
+                                               defaultTimeout() if timeout is None else timeout)
         self.uuid = str(uuid.uuid4())
         self.threadLocLevel = 0
+        # cleared the first time the server replies to a batch with a single error
+        self.batchSupported = True
+        # None until the first stepUntil reply tells whether the server has it
+        self.stepUntilSupported = None
+        # local mirror of the simulation time, advanced by step() and stepUntil()
+        self.simTime = None
+        self.simTimeStep = None
 
     def __del__(self):
-        """Disconnect and destroy client."""
-        self.socket.close()
-        self.cntsocket.close()
-        self.context.term()
+        """Disconnect and destroy client.
+
+        Only close() and __exit__ hand the sockets back to the manager: a
+        client collected in a reference cycle (e.g. through client.sim) may
+        find its sockets already closed by pyzmq, so they are dropped here.
+        """
+        if getattr(self, 'connection', None) is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def close(self):
+        """Hand the sockets back to the connection manager for the next client."""
+        if getattr(self, 'connection', None) is not None:
+            self.manager.release(self.connection)
+            self.connection = None
+
+    def healthCheck(self, timeout=1.0):
+        """Return whether the server answers a cheap call within timeout seconds."""
+        previous = self.connection.timeout
+        self.connection.setTimeout(timeout)
+        try:
+            self.call('sim.getSimulationState', [])
+        except TimeoutError:
+            return False
+        except Exception:
+            # an error reply still comes from a live server
+            pass
+        finally:
+            self.connection.setTimeout(previous)
+        return True
 
     def _send(self, req):
+        start = perf_counter()
         if self.verbose > 0:
             print('Sending:', req)
-        rawReq = cbor.dumps(req)
+        rawReq = self.codec.dumps(req)
         if self.verbose > 1:
             print(f'Sending raw len={len(rawReq)}, base64={b64(rawReq)}')
-        self.socket.send(rawReq)
+        self.connection.send(rawReq)
+        if self.profiler is not None:
+            self._inFlight = (req, start, len(rawReq))
 
     def _recv(self):
-        rawResp = self.socket.recv()
+        rawResp = self.connection.recv()
         if self.verbose > 1:
             print(f'Received raw len={len(rawResp)}, base64={b64(rawResp)}')
-        resp = cbor.loads(rawResp)
+        resp = self.codec.loads(rawResp)
         if self.verbose > 0:
             print('Received:', resp)
+        if self.profiler is not None:
+            req, start, sent = self._inFlight
+            self.profiler.record(req, perf_counter() - start, sent, len(rawResp), resp)
         return resp
 
     def _process_response(self, resp):
@@ -70,20 +160,50 @@ class RemoteAPIClient:
         self._send({'func': func, 'args': args})
         return self._process_response(self._recv())
 
+    def callMany(self, calls, *, returnExceptions=False):
+        """Call several functions in one request/reply exchange.
+
+        calls is a sequence of (func, args) pairs. Results are returned in the
+        same order. If returnExceptions is True, a failed call yields its
+        exception in place of a result instead of raising.
+        """
+        reqs = [{'func': func, 'args': args} for func, args in calls]
+        if not reqs:
+            return []
+        resps = None
+        if self.batchSupported:
+            self._send(reqs)
+            resps = self._recv()
+            if isinstance(resps, dict):
+                # server predates batched requests, fall back to one call each
+                self.batchSupported = False
+                resps = None
+        if resps is None:
+            resps = []
+            for req in reqs:
+                self._send(req)
+                resps.append(self._recv())
+        if len(resps) != len(reqs):
+            raise Exception(f'expected {len(reqs)} responses, got {len(resps)}')
+        results = []
+        for resp in resps:
+            try:
+                results.append(self._process_response(resp))
+            except Exception as e:
+                if not returnExceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def batch(self, *, returnExceptions=False):
+        """Return a context manager queueing calls to be sent as one batch."""
+        return RemoteAPIBatch(self, returnExceptions=returnExceptions)
+
     def getObject(self, name, _info=None):
         """Retrieve remote object from server."""
-        ret = type(name, (), {})
         if not _info:
-            _info = self.call('zmqRemoteApi.info', [name])
-        for k, v in _info.items():
-            if not isinstance(v, dict):
-                raise ValueError('found nondict')
-            if len(v) == 1 and 'func' in v:
-                setattr(ret, k, lambda *a, func=f'{name}.{k}': self.call(func, a))
-            elif len(v) == 1 and 'const' in v:
-                setattr(ret, k, v['const'])
-            else:
-                setattr(ret, k, self.getObject(f'{name}.{k}', _info=v))
+            _info = self._getInfo(name)
+        ret = RemoteObject(name, _info, self.call)
         if name=="sim":
             ret.wait=self._wait
             ret.waitForSignal=self._waitForSignal
@@ -92,6 +212,27 @@ class RemoteAPIClient:
             self.sim=ret
         return ret
 
+    def _getInfo(self, name):
+        if self.schemaCache is None:
+            return self.call('zmqRemoteApi.info', [name])
+        fetched = {}
+        if self.serverVersion is None:
+            # any cached sim schema knows which constants hold the version
+            simInfo = self.schemaCache.loadNewest('sim')
+            if simInfo is None:
+                simInfo = fetched['sim'] = self.call('zmqRemoteApi.info', ['sim'])
+            calls = versionCalls(simInfo)
+            if calls is None:
+                return fetched.get(name) or self.call('zmqRemoteApi.info', [name])
+            self.serverVersion = '.'.join(str(v) for v in self.callMany(calls))
+            if 'sim' in fetched:
+                self.schemaCache.save('sim', self.serverVersion, fetched['sim'])
+        info = fetched.get(name) or self.schemaCache.load(name, self.serverVersion)
+        if info is None:
+            info = self.call('zmqRemoteApi.info', [name])
+            self.schemaCache.save(name, self.serverVersion, info)
+        return info
+
     def setStepping(self, enable=True):
         if self.threadLocLevel > 0:
             if enable == False:
@@ -102,18 +243,106 @@ class RemoteAPIClient:
                 self.threadLocLevel = 1
                 return self.call('setStepping', [enable,self.uuid])
 
-    def step(self, *, wait=True):
+    def step(self, n=1, *, wait=True):
+        """Advance n simulation steps when in stepping mode.
+
+        Several steps go out as a single stepUntil request once a stepUntil
+        reply showed that the server implements it (the stand-in server does,
+        CoppeliaSim does not), else as one step request each.
+        """
         if self.threadLocLevel > 0:
+            # never probe from here: a server without stepUntil would cost a failed request
+            if n > 1 and self.stepUntilSupported is True:
+                if self._stepUntilServer(untilCondition(maxSteps=n), wait) is not None:
+                    return
+            for _ in range(n):
+                self.getStepCount(False)
+                self.call('step', [self.uuid])
+                self.getStepCount(wait)
+                if self.simTime is not None:
+                    self.simTime += self.simTimeStep
+
+    def stepUntil(self, signal=None, value=None, *, signalType=None, simTime=None, maxSteps=None, minSteps=0, extraSteps=0):
+        """Step until a signal is set, simTime seconds passed or maxSteps steps were taken.
+
+        The signal must equal value unless value is None; signalType limits
+        the check to one signal type (see stepping.SIGNAL_GETTERS). Conditions
+        are checked before every step once minSteps steps were taken, and
+        extraSteps more steps follow a met condition. A server implementing
+        stepUntil (only the stand-in in server.py) runs the whole loop and
+        answers once; against CoppeliaSim the loop is run from here.
+        Returns {'steps', 'met', 'value', 'simTime', 'timeStep'}.
+        """
+        until = untilCondition(signal, value, signalType, simTime, maxSteps, minSteps, extraSteps)
+        lb=self._setThreadAutomaticSwitch(False)
+        result = None
+        if self.stepUntilSupported is not False:
+            result = self._stepUntilServer(until)
+        if result is None:
+            result = self._stepUntilClient(until)
+        self._setThreadAutomaticSwitch(lb)
+        return result
+
+    def _stepUntilServer(self, until, wait=True):
+        total = 0
+        while True:
             self.getStepCount(False)
-            self.call('step', [self.uuid])
-            self.getStepCount(wait)
+            try:
+                result = self.call('stepUntil', [self.uuid, until])
+            except Exception as e:
+                # only a server without stepUntil falls back, errors and timeouts propagate
+                if total or not unknownFunction(e, 'stepUntil'):
+                    raise
+                self.stepUntilSupported = False
+                return None
+            self.stepUntilSupported = True
+            if result['steps']:
+                self.getStepCount(wait)
+            total += result['steps']
+            self.simTime, self.simTimeStep = result['simTime'], result['timeStep']
+            if finished(until, result):
+                return dict(result, steps=total)
+            # the server stopped at its step limit, carry on from there
+            until = remainingCondition(until, result)
+
+    def _stepUntilClient(self, until):
+        if until['simTime'] is not None and self.simTimeStep is None:
+            self._syncSimTime()
+        timeSteps = None if until['simTime'] is None else stepsFor(until['simTime'], self.simTimeStep)
+        getters = signalGetters(until) if until['signal'] is not None else []
+        steps = 0
+        met = False
+        current = None
+        while True:
+            if steps >= until['minSteps']:
+                if getters:
+                    current = signalValue(self.callMany([(getter, [until['signal']]) for getter in getters]))
+                    met = signalMet(until, current)
+                if not met and timeSteps is not None:
+                    met = steps >= timeSteps
+                if met or (until['maxSteps'] is not None and steps >= until['maxSteps']):
+                    break
+            self.step()
+            steps += 1
+        if met:
+            for _ in range(until['extraSteps']):
+                self.step()
+                steps += 1
+        return {'steps': steps, 'met': met, 'value': current, 'simTime': self.simTime, 'timeStep': self.simTimeStep}
+
+    def _syncSimTime(self):
+        self.simTime, self.simTimeStep = self.callMany([('sim.getSimulationTime', []), ('sim.getSimulationTimeStep', [])])
+        return self.simTime
 
     def getStepCount(self, wait):
         if self.threadLocLevel > 0:
+            start = perf_counter()
             try:
-                self.cntsocket.recv(0 if wait else zmq.NOBLOCK)
+                self.connection.recvCount(wait)
             except zmq.ZMQError:
                 pass
+            if wait and self.profiler is not None:
+                self.profiler.recordStepWait(perf_counter() - start)
 
     def _setThreadAutomaticSwitch(self, level):
         newLevel = self.threadLocLevel
@@ -139,27 +368,19 @@ class RemoteAPIClient:
         lb=self._setThreadAutomaticSwitch(False)
         retVal = 0.0
         if simTime:
-            st = self.sim.getSimulationTime()
-            while (self.sim.getSimulationTime()-st < dt):
-                self.step()
-            retVal=self.sim.getSimulationTime()-st-dt
+            # one read, then the mirror follows the steps
+            st = self._syncSimTime()
+            self.stepUntil(simTime=dt)
+            retVal=self.simTime-st-dt
         else:
-            st = self.sim.getSystemTimeInMs(-1)
-            while (self.sim.getSystemTimeInMs(st) < dt*1000):
+            st = monotonic()
+            while (monotonic()-st < dt):
                 self.step()
         self._setThreadAutomaticSwitch(lb)
         return retVal
 
     def _waitForSignal(self, sigName):
-        lb=self._setThreadAutomaticSwitch(False)
-        retVal = 0.0
-        while True:
-            retVal = self.sim.getInt32Signal(sigName)!=None or self.sim.getFloatSignal(sigName)!=None or self.sim.getDoubleSignal(sigName)!=None or self.sim.getStringSignal(sigName)!=None
-            if retVal:
-                break
-            self.step()
-        self._setThreadAutomaticSwitch(lb)
-        return retVal
+        return self.stepUntil(sigName)['met']
 
     def _moveToConfig(self, flags,currentPos,currentVel,currentAccel,maxVel,maxAccel,maxJerk,targetPos,targetVel,callback,auxData=None,cyclicJoints=None,timeStep=0):
         lb=self._setThreadAutomaticSwitch(False)
@@ -344,4 +565,4 @@ if __name__ == '__console__':
     sim = client.getObject('sim')
 
 
-__all__ = ['RemoteAPIClient']
+__all__ = ['RemoteAPIClient', 'RemoteAPIBatch']
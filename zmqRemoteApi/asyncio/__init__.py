@@ -1,17 +1,25 @@
 """CoppeliaSim's Remote API client."""
 
 import asyncio
+import inspect
+import math
 import sys
 import os
+import time
 import uuid
 
 from contextlib import contextmanager
 
-import cbor
-
 import zmq
 import zmq.asyncio
 
+from ..codec import getCodec
+from ..connection import defaultTimeout
+from ..profiler import getProfiler
+from ..schema import RemoteObject, SchemaCache, defaultCacheDir, versionCalls
+from ..stepping import (finished, remainingCondition, signalGetters, signalMet, signalValue,
+                        stepsFor, unknownFunction, untilCondition)
+
 
 if sys.platform == 'win32' and sys.version_info >= (3, 8, 0):
     if isinstance(asyncio.get_event_loop_policy(), asyncio.windows_events.WindowsProactorEventLoopPolicy):
@@ -30,22 +38,48 @@ def b64(b):
     return base64.b64encode(b).decode('ascii')
 
 
+async def _maybeAwait(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
 class RemoteAPIClient:
     """Client to connect to CoppeliaSim's ZMQ Remote API."""
 
-    def __init__(self, host='localhost', port=23000, cntport=None, *, verbose=None):
-        """Create client and connect to the ZMQ Remote API server."""
+    def __init__(self, host='localhost', port=23000, cntport=None, *, verbose=None, cacheDir=None, codec=None, profile=None, timeout=None):
+        """Create client and connect to the ZMQ Remote API server.
+
+        Schemas are cached on disk, messages encoded with the codec and calls
+        profiled as in the synchronous client. All clients share one
+        zmq.asyncio context; a reply missing for timeout seconds raises
+        TimeoutError and its socket is replaced.
+        """
         self.verbose = int(os.environ.get('VERBOSE', '0')) if verbose is None else verbose
+        self.codec = getCodec(codec)
+        self.profiler = getProfiler(profile)
+        # request, start time and size of the request in flight on each socket
+        self._inFlight = {}
         self.host, self.port, self.cntport = host, port, cntport or port + 1
+        self.timeout = defaultTimeout() if timeout is None else timeout
         self.cntsocket = None
         self.uuid=str(uuid.uuid4())
+        self.threadLocLevel = 0
+        self.batchSupported = True
+        self.stepUntilSupported = None
+        self.simTime = None
+        self.simTimeStep = None
+        cacheDir = defaultCacheDir() if cacheDir is None else cacheDir
+        self.schemaCache = SchemaCache(cacheDir) if cacheDir else None
+        self.serverVersion = None
         # multiple sockets will be created for multiple concurrent requests, as needed
         self.sockets = []
 
     async def __aenter__(self):
         """Add one socket to the pool."""
-        self.context = zmq.asyncio.Context()
+        self.context = zmq.asyncio.Context.instance()
         self.cntsocket = self.context.socket(zmq.SUB)
+        self.cntsocket.setsockopt(zmq.LINGER, 0)
         self.cntsocket.setsockopt(zmq.SUBSCRIBE, b'')
         self.cntsocket.setsockopt(zmq.CONFLATE, 1)
         self.cntsocket.connect(f'tcp://{self.host}:{self.cntport}')
@@ -55,13 +89,24 @@ class RemoteAPIClient:
         """Disconnect and destroy client."""
         for socket in self.sockets:
             socket.close()
+        self.sockets = []
         self.cntsocket.close()
-        self.context.term()
+
+    async def healthCheck(self, timeout=1.0):
+        """Return whether the server answers a cheap call within timeout seconds."""
+        try:
+            await asyncio.wait_for(self.call('sim.getSimulationState', []), timeout)
+        except (TimeoutError, asyncio.TimeoutError):
+            return False
+        except Exception:
+            pass
+        return True
 
     @contextmanager
     def _socket(self):
         if not self.sockets:
             socket = self.context.socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
             socket.connect(f'tcp://{self.host}:{self.port}')
             if self.verbose > 0:
                 print('Added a new socket:', socket)
@@ -71,24 +116,41 @@ class RemoteAPIClient:
                 print('Reusing existing socket:', socket)
         try:
             yield socket
+        except asyncio.CancelledError:
+            # the reply may still arrive, so the socket cannot be reused
+            socket.close()
+            raise
         finally:
-            self.sockets.append(socket)
+            # sockets closed after a timeout are not reused
+            if not socket.closed:
+                self.sockets.append(socket)
 
     async def _send(self, socket, req):
+        start = time.perf_counter()
         if self.verbose > 0:
             print('Sending:', req, socket)
-        rawReq = cbor.dumps(req)
+        rawReq = self.codec.dumps(req)
         if self.verbose > 1:
             print(f'Sending raw len={len(rawReq)}, base64={b64(rawReq)}')
         await socket.send(rawReq)
+        if self.profiler is not None:
+            self._inFlight[socket] = (req, start, len(rawReq))
 
     async def _recv(self, socket):
-        rawResp = await socket.recv()
+        try:
+            rawResp = await asyncio.wait_for(socket.recv(), self.timeout)
+        except asyncio.TimeoutError:
+            self._inFlight.pop(socket, None)
+            socket.close()
+            raise TimeoutError(f'no reply from tcp://{self.host}:{self.port} within {self.timeout}s') from None
         if self.verbose > 1:
             print(f'Received raw len={len(rawResp)}, base64={b64(rawResp)}')
-        resp = cbor.loads(rawResp)
+        resp = self.codec.loads(rawResp)
         if self.verbose > 0:
             print('Received:', resp, socket)
+        if self.profiler is not None:
+            req, start, sent = self._inFlight.pop(socket)
+            self.profiler.record(req, time.perf_counter() - start, sent, len(rawResp), resp)
         return resp
 
     def _process_response(self, resp):
@@ -106,35 +168,391 @@ class RemoteAPIClient:
             await self._send(socket, {'func': func, 'args': args})
             return self._process_response(await self._recv(socket))
 
+    async def callMany(self, calls, *, returnExceptions=False):
+        """Call several functions in one request/reply exchange.
+
+        Same semantics as the synchronous RemoteAPIClient.callMany.
+        """
+        reqs = [{'func': func, 'args': args} for func, args in calls]
+        if not reqs:
+            return []
+        resps = None
+        with self._socket() as socket:
+            if self.batchSupported:
+                await self._send(socket, reqs)
+                resps = await self._recv(socket)
+                if isinstance(resps, dict):
+                    self.batchSupported = False
+                    resps = None
+            if resps is None:
+                resps = []
+                for req in reqs:
+                    await self._send(socket, req)
+                    resps.append(await self._recv(socket))
+        if len(resps) != len(reqs):
+            raise Exception(f'expected {len(reqs)} responses, got {len(resps)}')
+        results = []
+        for resp in resps:
+            try:
+                results.append(self._process_response(resp))
+            except Exception as e:
+                if not returnExceptions:
+                    raise
+                results.append(e)
+        return results
+
     async def getObject(self, name, _info=None):
-        """Retrieve remote object from server."""
-        ret = type(name, (), {})
+        """Retrieve remote object from server.
+
+        Functions of the returned object are coroutine functions; nested
+        namespaces are plain attributes.
+        """
         if not _info:
-            _info = await self.call('zmqRemoteApi.info', [name])
-        for k, v in _info.items():
-            if not isinstance(v, dict):
-                raise ValueError('found nondict')
-            if len(v) == 1 and 'func' in v:
-                setattr(ret, k, lambda *a, func=f'{name}.{k}': self.call(func, a))
-            elif len(v) == 1 and 'const' in v:
-                setattr(ret, k, v['const'])
-            else:
-                setattr(ret, k, self.getObject(f'{name}.{k}', _info=v))
+            _info = await self._getInfo(name)
+        ret = RemoteObject(name, _info, self.call)
+        if name=="sim":
+            ret.wait=self._wait
+            ret.waitForSignal=self._waitForSignal
+            ret.moveToConfig=self._moveToConfig
+            ret.moveToPose=self._moveToPose
+            self.sim=ret
         return ret
 
+    async def _getInfo(self, name):
+        if self.schemaCache is None:
+            return await self.call('zmqRemoteApi.info', [name])
+        fetched = {}
+        if self.serverVersion is None:
+            simInfo = self.schemaCache.loadNewest('sim')
+            if simInfo is None:
+                simInfo = fetched['sim'] = await self.call('zmqRemoteApi.info', ['sim'])
+            calls = versionCalls(simInfo)
+            if calls is None:
+                return fetched.get(name) or await self.call('zmqRemoteApi.info', [name])
+            self.serverVersion = '.'.join(str(v) for v in await self.callMany(calls))
+            if 'sim' in fetched:
+                self.schemaCache.save('sim', self.serverVersion, fetched['sim'])
+        info = fetched.get(name) or self.schemaCache.load(name, self.serverVersion)
+        if info is None:
+            info = await self.call('zmqRemoteApi.info', [name])
+            self.schemaCache.save(name, self.serverVersion, info)
+        return info
+
     async def setStepping(self, enable=True):
-        return await self.call('setStepping', [enable,self.uuid])
+        if self.threadLocLevel > 0:
+            if enable == False:
+                self.threadLocLevel = 0
+                return await self.call('setStepping', [enable,self.uuid])
+        else:
+            if enable == True:
+                self.threadLocLevel = 1
+                return await self.call('setStepping', [enable,self.uuid])
+
+    async def step(self, n=1, *, wait=True):
+        """Same semantics as the synchronous RemoteAPIClient.step."""
+        if self.threadLocLevel > 0:
+            # never probe from here: a server without stepUntil would cost a failed request
+            if n > 1 and self.stepUntilSupported is True:
+                if await self._stepUntilServer(untilCondition(maxSteps=n), wait) is not None:
+                    return
+            for _ in range(n):
+                await self.getStepCount(False)
+                await self.call('step', [self.uuid])
+                await self.getStepCount(wait)
+                if self.simTime is not None:
+                    self.simTime += self.simTimeStep
+
+    async def stepUntil(self, signal=None, value=None, *, signalType=None, simTime=None, maxSteps=None, minSteps=0, extraSteps=0):
+        """Same semantics as the synchronous RemoteAPIClient.stepUntil."""
+        until = untilCondition(signal, value, signalType, simTime, maxSteps, minSteps, extraSteps)
+        lb=await self._setThreadAutomaticSwitch(False)
+        result = None
+        if self.stepUntilSupported is not False:
+            result = await self._stepUntilServer(until)
+        if result is None:
+            result = await self._stepUntilClient(until)
+        await self._setThreadAutomaticSwitch(lb)
+        return result
+
+    async def _stepUntilServer(self, until, wait=True):
+        total = 0
+        while True:
+            await self.getStepCount(False)
+            try:
+                result = await self.call('stepUntil', [self.uuid, until])
+            except Exception as e:
+                # only a server without stepUntil falls back, errors and timeouts propagate
+                if total or not unknownFunction(e, 'stepUntil'):
+                    raise
+                self.stepUntilSupported = False
+                return None
+            self.stepUntilSupported = True
+            if result['steps']:
+                await self.getStepCount(wait)
+            total += result['steps']
+            self.simTime, self.simTimeStep = result['simTime'], result['timeStep']
+            if finished(until, result):
+                return dict(result, steps=total)
+            until = remainingCondition(until, result)
 
-    async def step(self, *, wait=True):
-        await self.getStepCount(False)
-        await self.call('step', [self.uuid])
-        await self.getStepCount(wait)
+    async def _stepUntilClient(self, until):
+        if until['simTime'] is not None and self.simTimeStep is None:
+            await self._syncSimTime()
+        timeSteps = None if until['simTime'] is None else stepsFor(until['simTime'], self.simTimeStep)
+        getters = signalGetters(until) if until['signal'] is not None else []
+        steps = 0
+        met = False
+        current = None
+        while True:
+            if steps >= until['minSteps']:
+                if getters:
+                    current = signalValue(await self.callMany([(getter, [until['signal']]) for getter in getters]))
+                    met = signalMet(until, current)
+                if not met and timeSteps is not None:
+                    met = steps >= timeSteps
+                if met or (until['maxSteps'] is not None and steps >= until['maxSteps']):
+                    break
+            await self.step()
+            steps += 1
+        if met:
+            for _ in range(until['extraSteps']):
+                await self.step()
+                steps += 1
+        return {'steps': steps, 'met': met, 'value': current, 'simTime': self.simTime, 'timeStep': self.simTimeStep}
+
+    async def _syncSimTime(self):
+        self.simTime, self.simTimeStep = await self.callMany([('sim.getSimulationTime', []), ('sim.getSimulationTimeStep', [])])
+        return self.simTime
 
     async def getStepCount(self, wait):
-        try:
-            await self.cntsocket.recv(0 if wait else zmq.NOBLOCK)
-        except zmq.ZMQError:
-            pass
+        if self.threadLocLevel > 0:
+            start = time.perf_counter()
+            try:
+                if wait:
+                    await asyncio.wait_for(self.cntsocket.recv(), self.timeout)
+                else:
+                    await self.cntsocket.recv(zmq.NOBLOCK)
+            except zmq.ZMQError:
+                pass
+            except asyncio.TimeoutError:
+                raise TimeoutError(f'no step counter message from tcp://{self.host}:{self.cntport} within {self.timeout}s') from None
+            if wait and self.profiler is not None:
+                self.profiler.recordStepWait(time.perf_counter() - start)
+
+    async def _setThreadAutomaticSwitch(self, level):
+        newLevel = self.threadLocLevel
+        if isinstance(level,bool):
+            if level == True:
+                newLevel -= 1
+                if newLevel < 0:
+                    newLevel = 0
+            if level == False:
+                newLevel += 1
+        else:
+            if level >= 0:
+                newLevel = level
+        if newLevel != self.threadLocLevel:
+            if newLevel == 0:
+                await self.setStepping(False)
+            if newLevel == 1 and self.threadLocLevel == 0:
+                await self.setStepping(True)
+            self.threadLocLevel = newLevel
+        return newLevel
+        
+    async def _wait(self, dt, simTime=True):
+        lb=await self._setThreadAutomaticSwitch(False)
+        retVal = 0.0
+        if simTime:
+            st = await self._syncSimTime()
+            await self.stepUntil(simTime=dt)
+            retVal=self.simTime-st-dt
+        else:
+            st = time.monotonic()
+            while (time.monotonic()-st < dt):
+                await self.step()
+        await self._setThreadAutomaticSwitch(lb)
+        return retVal
+
+    async def _waitForSignal(self, sigName):
+        return (await self.stepUntil(sigName))['met']
+
+    async def _moveToConfig(self, flags,currentPos,currentVel,currentAccel,maxVel,maxAccel,maxJerk,targetPos,targetVel,callback,auxData=None,cyclicJoints=None,timeStep=0):
+        lb=await self._setThreadAutomaticSwitch(False)
+
+        currentPosVelAccel=[]
+        maxVelAccelJerk=[]
+        targetPosVel=[]
+        sel=[]
+        outPos=[]
+        outVel=[]
+        outAccel=[]
+        for i in range(len(currentPos)):
+            v=currentPos[i]
+            currentPosVelAccel.append(v)
+            outPos.append(v)
+            maxVelAccelJerk.append(maxVel[i])
+            w=targetPos[i]
+            if cyclicJoints and cyclicJoints[i]:
+                while w-v>=math.pi*2:
+                    w=w-math.pi*2
+                while w-v<0:
+                    w=w+math.pi*2
+                if w-v>math.pi:
+                    w=w-math.pi*2
+            targetPosVel.append(w)
+            sel.append(1)
+        for i in range(len(currentPos)):
+            if currentVel:
+                currentPosVelAccel.append(currentVel[i])
+                outVel.append(currentVel[i])
+            else:
+                currentPosVelAccel.append(0)
+                outVel.append(0)
+            maxVelAccelJerk.append(maxAccel[i])
+            if targetVel:
+                targetPosVel.append(targetVel[i])
+            else:
+                targetPosVel.append(0)
+        for i in range(len(currentPos)):
+            if currentAccel:
+                currentPosVelAccel.append(currentAccel[i])
+                outAccel.append(currentAccel[i])
+            else:
+                currentPosVelAccel.append(0)
+                outAccel.append(0)
+            maxVelAccelJerk.append(maxJerk[i])
+
+        if len(maxVel) > len(currentPos):
+            for i in range(len(maxVel)-len(currentPos)):
+                currentPosVelAccel.append(maxVel[len(currentPos)+i])
+        if len(maxAccel) > len(currentPos):
+            for i in range(len(maxAccel)-len(currentPos)):
+                currentPosVelAccel.append(maxAccel[len(currentPos)+i])
+                
+        ruckigObject = await self.sim.ruckigPos(len(currentPos),0.0001,flags,currentPosVelAccel,maxVelAccelJerk,sel,targetPosVel)
+        result = 0
+        timeLeft = 0
+        while (result == 0):
+            dt = timeStep
+            if dt == 0:
+                dt=await self.sim.getSimulationTimeStep()
+            syncTime = 0
+            result,newPosVelAccel,syncTime = await self.sim.ruckigStep(ruckigObject,dt)
+            if result >= 0:
+                if result == 0:
+                    timeLeft = dt-syncTime
+                for i in range(len(currentPos)):
+                    outPos[i]=newPosVelAccel[i]
+                    outVel[i]=newPosVelAccel[len(currentPos)+i]
+                    outAccel[i]=newPosVelAccel[len(currentPos)*2+i]
+                if await _maybeAwait(callback(outPos,outVel,outAccel,auxData)):
+                    break
+            else:
+                raise RuntimeError("sim.ruckigStep returned error code "+result)
+            if result == 0:
+                await self.step()
+        await self.sim.ruckigRemove(ruckigObject)
+        await self._setThreadAutomaticSwitch(lb)
+        return outPos,outVel,outAccel,timeLeft
+
+    async def _moveToPose(self, flags,currentPoseOrMatrix,maxVel,maxAccel,maxJerk,targetPoseOrMatrix,callback,auxData=None,metric=None,timeStep=0):
+        lb = await self._setThreadAutomaticSwitch(False)
+
+        usingMatrices = (len(currentPoseOrMatrix)>=12)
+        if usingMatrices:
+            currentMatrix = currentPoseOrMatrix
+            targetMatrix = targetPoseOrMatrix
+        else:
+            currentMatrix = await self.sim.buildMatrixQ(currentPoseOrMatrix,[currentPoseOrMatrix[3],currentPoseOrMatrix[4],currentPoseOrMatrix[5],currentPoseOrMatrix[6]])
+            targetMatrix = await self.sim.buildMatrixQ(targetPoseOrMatrix,[targetPoseOrMatrix[3],targetPoseOrMatrix[4],targetPoseOrMatrix[5],targetPoseOrMatrix[6]])
+
+        outMatrix = await self.sim.copyTable(currentMatrix)
+        axis,angle = await self.sim.getRotationAxis(currentMatrix,targetMatrix)
+        timeLeft = 0
+        if metric:
+            # Here we treat the movement as a 1 DoF movement, where we simply interpolate via t between
+            # the start and goal pose. This always results in straight line movement paths
+            dx = [(targetMatrix[3]-currentMatrix[3])*metric[0],(targetMatrix[7]-currentMatrix[7])*metric[1],(targetMatrix[11]-currentMatrix[11])*metric[2],angle*metric[3]]
+            distance = math.sqrt(dx[0]*dx[0]+dx[1]*dx[1]+dx[2]*dx[2]+dx[3]*dx[3])
+            if distance > 0.000001:
+                currentPosVelAccel = [0,0,0]
+                maxVelAccelJerk = [maxVel[0],maxAccel[0],maxJerk[0]]
+                if len(maxVel) > 1:
+                    maxVelAccelJerk.append(maxVel[1])
+                if len(maxAccel) > 1:
+                    maxVelAccelJerk.append(maxAccel[1])
+                targetPosVel = [distance,0]
+                ruckigObject = await self.sim.ruckigPos(1,0.0001,flags,currentPosVelAccel,maxVelAccelJerk,[1],targetPosVel)
+                result = 0
+                while (result == 0):
+                    dt = timeStep
+                    if dt == 0:
+                        dt = await self.sim.getSimulationTimeStep()
+                    result,newPosVelAccel,syncTime = await self.sim.ruckigStep(ruckigObject,dt)
+                    if result >= 0:
+                        if result == 0:
+                            timeLeft = dt-syncTime
+                        t = newPosVelAccel[0]/distance
+                        outMatrix = await self.sim.interpolateMatrices(currentMatrix,targetMatrix,t)
+                        nv = [newPosVelAccel[1]]
+                        na = [newPosVelAccel[2]]
+                        if not usingMatrices:
+                            q = await self.sim.getQuaternionFromMatrix(outMatrix)
+                            outMatrix = [outMatrix[3],outMatrix[7],outMatrix[11],q[0],q[1],q[2],q[3]]
+                        if await _maybeAwait(callback(outMatrix,nv,na,auxData)):
+                            break
+                    else:
+                        raise RuntimeError("sim.ruckigStep returned error code "+result)
+                    if result == 0:
+                        await self.step()
+                await self.sim.ruckigRemove(ruckigObject)
+        else:
+            # Here we treat the movement as a 4 DoF movement, where each of X, Y, Z and rotation
+            # is handled and controlled individually. This can result in non-straight line movement paths,
+            # due to how the Ruckig functions operate depending on 'flags'
+            dx = [targetMatrix[3]-currentMatrix[3],targetMatrix[7]-currentMatrix[7],targetMatrix[11]-currentMatrix[11],angle]
+            currentPosVelAccel = [0,0,0,0,0,0,0,0,0,0,0,0]
+            maxVelAccelJerk = [maxVel[0],maxVel[1],maxVel[2],maxVel[3],maxAccel[0],maxAccel[1],maxAccel[2],maxAccel[3],maxJerk[0],maxJerk[1],maxJerk[2],maxJerk[3]]
+            if len(maxVel) > 4:
+                for i in range(len(maxVel)-len(maxJerk)):
+                    maxVelAccelJerk.append(maxVel[len(maxJerk)+i])
+            if len(maxAccel) > 4:
+                for i in range(len(maxAccel)-len(maxJerk)):
+                    maxVelAccelJerk.append(maxAccel[len(maxJerk)+i])
+            targetPosVel = [dx[0],dx[1],dx[2],dx[3],0,0,0,0,0]
+            ruckigObject = await self.sim.ruckigPos(4,0.0001,flags,currentPosVelAccel,maxVelAccelJerk,[1,1,1,1],targetPosVel)
+            result = 0
+            while (result == 0):
+                dt = timeStep
+                if dt == 0:
+                    dt = await self.sim.getSimulationTimeStep()
+                result,newPosVelAccel,syncTime = await self.sim.ruckigStep(ruckigObject,dt)
+                if result >= 0:
+                    if result == 0:
+                        timeLeft = dt-syncTime
+                    t = 0
+                    if abs(angle)>math.pi*0.00001:
+                        t = newPosVelAccel[3]/angle
+                    outMatrix = await self.sim.interpolateMatrices(currentMatrix,targetMatrix,t)
+                    outMatrix[3] = currentMatrix[3]+newPosVelAccel[0]
+                    outMatrix[7] = currentMatrix[7]+newPosVelAccel[1]
+                    outMatrix[11] = currentMatrix[11]+newPosVelAccel[2]
+                    nv = [newPosVelAccel[4],newPosVelAccel[5],newPosVelAccel[6],newPosVelAccel[7]]
+                    na = [newPosVelAccel[8],newPosVelAccel[9],newPosVelAccel[10],newPosVelAccel[11]]
+                    if not usingMatrices:
+                        q = await self.sim.getQuaternionFromMatrix(outMatrix)
+                        outMatrix = [outMatrix[3],outMatrix[7],outMatrix[11],q[0],q[1],q[2],q[3]]
+                    if await _maybeAwait(callback(outMatrix,nv,na,auxData)):
+                        break
+                else:
+                    raise RuntimeError("sim.ruckigStep returned error code "+result)
+                if result == 0:
+                    await self.step()
+            await self.sim.ruckigRemove(ruckigObject)
+
+        await self._setThreadAutomaticSwitch(lb)
+        return outMatrix,timeLeft
+
 
 
 __all__ = ['RemoteAPIClient']
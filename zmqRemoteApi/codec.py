@@ -0,0 +1,119 @@
+"""Serialization codecs for the remote API messages.
+
+Both codecs produce standard CBOR, so either can talk to the server:
+
+- 'cbor2' uses the cbor2 package, which is C-accelerated when its _cbor2
+  extension is available. It decodes RFC 8746 typed arrays straight into
+  NumPy arrays, encodes NumPy arrays and scalars, and with typedArrays=True
+  sends float arrays as typed arrays instead of lists of floats.
+- 'cbor' uses the cbor package, the historical default, which has its own
+  C extension.
+
+getCodec() picks cbor2 when its C extension is installed and cbor otherwise,
+unless $ZMQREMOTEAPI_CODEC or the codec argument names one explicitly;
+'cbor2-typed' is cbor2 with typedArrays=True. The stand-in server in
+server.py makes the same choice, so in one environment both ends agree.
+"""
+
+import os
+
+# RFC 8746 typed array tags, 64..87, decoded as tag -> NumPy dtype string
+TYPED_ARRAY_DTYPES = {
+    64: 'u1', 65: '>u2', 66: '>u4', 67: '>u8', 68: 'u1', 69: '<u2', 70: '<u4', 71: '<u8',
+    72: 'i1', 73: '>i2', 74: '>i4', 75: '>i8', 77: '<i2', 78: '<i4', 79: '<i8',
+    80: '>f2', 81: '>f4', 82: '>f8', 84: '<f2', 85: '<f4', 86: '<f8',
+}
+FLOAT32_LE = 85
+FLOAT64_LE = 86
+
+
+class CborCodec:
+    """cbor package, plain Python types only."""
+
+    name = 'cbor'
+
+    def __init__(self):
+        import cbor
+        self._cbor = cbor
+
+    def dumps(self, obj):
+        return self._cbor.dumps(obj)
+
+    def loads(self, data):
+        return self._cbor.loads(data)
+
+
+class Cbor2Codec:
+    """cbor2 package with NumPy and typed array support."""
+
+    name = 'cbor2'
+
+    def __init__(self, typedArrays=False):
+        import cbor2
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        self._cbor2 = cbor2
+        self._np = numpy
+        self.typedArrays = typedArrays
+        try:
+            import _cbor2  # noqa: F401
+            self.accelerated = True
+        except ImportError:
+            self.accelerated = False
+
+    def _default(self, encoder, value):
+        np = self._np
+        if np is not None and isinstance(value, np.ndarray):
+            if self.typedArrays and value.dtype.kind == 'f' and value.ndim == 1:
+                if value.dtype.itemsize == 4:
+                    encoder.encode(self._cbor2.CBORTag(FLOAT32_LE, value.astype('<f4').tobytes()))
+                else:
+                    encoder.encode(self._cbor2.CBORTag(FLOAT64_LE, value.astype('<f8').tobytes()))
+            else:
+                encoder.encode(value.tolist())
+        elif np is not None and isinstance(value, np.generic):
+            encoder.encode(value.item())
+        else:
+            raise TypeError(f'cannot serialize {type(value).__name__}')
+
+    def _tagHook(self, *args):
+        # cbor2 < 6 calls tag_hook(decoder, tag), cbor2 6 calls tag_hook(tag, immutable)
+        tag = next(arg for arg in args if isinstance(arg, self._cbor2.CBORTag))
+        dtype = TYPED_ARRAY_DTYPES.get(tag.tag)
+        if dtype is None or self._np is None or not isinstance(tag.value, bytes):
+            return tag
+        # one memcpy into a writable array, no per element Python objects
+        return self._np.frombuffer(tag.value, dtype=dtype).copy()
+
+    def dumps(self, obj):
+        return self._cbor2.dumps(obj, default=self._default)
+
+    def loads(self, data):
+        return self._cbor2.loads(data, tag_hook=self._tagHook)
+
+
+CODECS = {'cbor': CborCodec, 'cbor2': Cbor2Codec, 'cbor2-typed': lambda: Cbor2Codec(typedArrays=True)}
+
+
+def getCodec(codec=None):
+    """Return a codec from a codec instance, a name in CODECS, or 'auto'."""
+    if codec is not None and not isinstance(codec, str):
+        return codec
+    name = codec or os.environ.get('ZMQREMOTEAPI_CODEC', 'auto')
+    if name == 'auto':
+        # the pure Python cbor2 decoder is slower than the cbor extension
+        try:
+            codec = Cbor2Codec()
+        except ImportError:
+            return CborCodec()
+        if codec.accelerated:
+            return codec
+        try:
+            return CborCodec()
+        except ImportError:
+            return codec
+    if name not in CODECS:
+        raise ValueError(f'unknown codec {name!r}, expected one of {sorted(CODECS)} or auto')
+    return CODECS[name]()
@@ -0,0 +1,157 @@
+"""Process wide ZMQ context and reusable connections to remote API servers.
+
+Every RemoteAPIClient used to create and terminate its own zmq.Context and
+sockets, and a REQ socket whose server went away blocked forever in recv.
+Clients now borrow a Connection from a ConnectionManager:
+
+- all connections share one context, zmq.Context.instance(), which is never
+  terminated by a client;
+- a closed client hands its sockets back, and the next client for the same
+  server picks them up instead of connecting again;
+- with a timeout, send and recv raise TimeoutError instead of blocking, and
+  the REQ socket, which is unusable after a missed reply, is replaced by a
+  freshly connected one first.
+
+The default timeout comes from $ZMQREMOTEAPI_TIMEOUT in seconds, 0 or unset
+meaning no timeout.
+"""
+
+import os
+
+import zmq
+
+
+def defaultTimeout():
+    timeout = float(os.environ.get('ZMQREMOTEAPI_TIMEOUT', '0'))
+    return timeout or None
+
+
+class Connection:
+    """REQ socket for calls and SUB socket for the step counter of one server."""
+
+    def __init__(self, context, host, port, cntport, timeout=None):
+        self.context = context
+        self.host = host
+        self.port = port
+        self.cntport = cntport
+        self.timeout = timeout
+        # a request was sent and its reply not received yet
+        self.pending = False
+        self.recycled = 0
+        self.socket = None
+        self.cntsocket = None
+        self.open()
+
+    @property
+    def key(self):
+        return (self.host, self.port, self.cntport)
+
+    @property
+    def closed(self):
+        # pyzmq closes sockets on its own when they are garbage collected
+        return self.socket is None or self.socket.closed or self.cntsocket.closed
+
+    def open(self):
+        timeoutMs = -1 if self.timeout is None else int(self.timeout * 1000)
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.setsockopt(zmq.SNDTIMEO, timeoutMs)
+        self.socket.setsockopt(zmq.RCVTIMEO, timeoutMs)
+        self.socket.connect(f'tcp://{self.host}:{self.port}')
+        self.cntsocket = self.context.socket(zmq.SUB)
+        self.cntsocket.setsockopt(zmq.LINGER, 0)
+        self.cntsocket.setsockopt(zmq.SUBSCRIBE, b'')
+        self.cntsocket.setsockopt(zmq.CONFLATE, 1)
+        self.cntsocket.setsockopt(zmq.RCVTIMEO, timeoutMs)
+        self.cntsocket.connect(f'tcp://{self.host}:{self.cntport}')
+        self.pending = False
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.cntsocket.close()
+            self.socket = self.cntsocket = None
+
+    def recycle(self):
+        """Replace both sockets with newly connected ones."""
+        self.close()
+        self.open()
+        self.recycled += 1
+
+    def setTimeout(self, timeout):
+        if timeout != self.timeout:
+            self.timeout = timeout
+            timeoutMs = -1 if timeout is None else int(timeout * 1000)
+            self.socket.setsockopt(zmq.SNDTIMEO, timeoutMs)
+            self.socket.setsockopt(zmq.RCVTIMEO, timeoutMs)
+            self.cntsocket.setsockopt(zmq.RCVTIMEO, timeoutMs)
+
+    def send(self, rawReq):
+        try:
+            self.socket.send(rawReq)
+        except zmq.Again:
+            self.recycle()
+            raise TimeoutError(f'no server accepted the request on tcp://{self.host}:{self.port} within {self.timeout}s') from None
+        self.pending = True
+
+    def recv(self):
+        try:
+            rawResp = self.socket.recv()
+        except zmq.Again:
+            self.recycle()
+            raise TimeoutError(f'no reply from tcp://{self.host}:{self.port} within {self.timeout}s') from None
+        self.pending = False
+        return rawResp
+
+    def recvCount(self, wait):
+        """Receive a step counter message; without wait only if one is queued."""
+        try:
+            return self.cntsocket.recv(0 if wait else zmq.NOBLOCK)
+        except zmq.Again:
+            if wait:
+                raise TimeoutError(f'no step counter message from tcp://{self.host}:{self.cntport} within {self.timeout}s') from None
+
+
+class ConnectionManager:
+    """Pool of idle connections per server, on one shared context."""
+
+    def __init__(self, context=None):
+        self.context = context or zmq.Context.instance()
+        self.idle = {}
+
+    def acquire(self, host, port, cntport, timeout=None):
+        idle = self.idle.get((host, port, cntport))
+        while idle:
+            connection = idle.pop()
+            if connection.closed:
+                connection.close()
+                continue
+            connection.setTimeout(timeout)
+            return connection
+        return Connection(self.context, host, port, cntport, timeout)
+
+    def release(self, connection):
+        if connection.closed:
+            connection.close()
+            return
+        if connection.pending:
+            # the reply would be read by the next client, start over instead
+            connection.recycle()
+        self.idle.setdefault(connection.key, []).append(connection)
+
+    def closeAll(self):
+        for connections in self.idle.values():
+            for connection in connections:
+                connection.close()
+        self.idle.clear()
+
+
+_defaultManager = None
+
+
+def defaultManager():
+    """Connection manager shared by the clients of this process."""
+    global _defaultManager
+    if _defaultManager is None:
+        _defaultManager = ConnectionManager()
+    return _defaultManager
@@ -0,0 +1,184 @@
+"""Low overhead profiling of remote API calls.
+
+A CallProfiler records, per remote function, the number of request/reply
+exchanges, a latency histogram and the request and response sizes, plus the
+time the client spent blocked waiting for step counter messages. Enable it
+per client with RemoteAPIClient(profile=True), or for every client in the
+process with $ZMQREMOTEAPI_PROFILE:
+
+    ZMQREMOTEAPI_PROFILE=1              print a summary to stderr at exit
+    ZMQREMOTEAPI_PROFILE=profile.json   write snapshot() as JSON at exit
+
+Clients enabled either way share the process wide defaultProfiler(), so
+the numbers survive Simulation being rebuilt. Batches are recorded as one
+exchange under 'batch <functions>'.
+"""
+
+import atexit
+import json
+import math
+import os
+import sys
+import time
+
+# histogram bucket k counts latencies in [2**(k-1), 2**k) microseconds
+BUCKETS = 32
+PERCENTILES = (50, 90, 99)
+
+
+class LatencyStats:
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = math.frexp(seconds * 1e6)[1] if seconds > 0 else 0
+        self.buckets[min(max(bucket, 0), BUCKETS - 1)] += 1
+
+    def percentile(self, p):
+        """Upper bound of the histogram bucket holding the p-th percentile, in seconds."""
+        target = self.count * p / 100
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min(2.0 ** bucket * 1e-6, self.max)
+        return self.max
+
+    def snapshot(self):
+        if not self.count:
+            return {'count': 0, 'total': 0.0}
+        summary = {'count': self.count, 'total': self.total, 'mean': self.total / self.count,
+                   'min': self.min, 'max': self.max}
+        summary.update({f'p{p}': self.percentile(p) for p in PERCENTILES})
+        # upper bucket bounds in seconds -> counts, empty buckets left out
+        summary['histogram'] = {f'{2.0 ** bucket * 1e-6:.6g}': n for bucket, n in enumerate(self.buckets) if n}
+        return summary
+
+
+class FunctionStats(LatencyStats):
+    __slots__ = ('calls', 'errors', 'bytesSent', 'bytesReceived')
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.errors = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+    def snapshot(self):
+        summary = super().snapshot()
+        summary.update(calls=self.calls, errors=self.errors, bytesSent=self.bytesSent, bytesReceived=self.bytesReceived)
+        return summary
+
+
+def exchangeName(req):
+    if isinstance(req, dict):
+        return req.get('func', '?')
+    return 'batch ' + ','.join(sorted({r.get('func', '?') for r in req}))
+
+
+class CallProfiler:
+    """Per function call statistics, see the module docstring."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.functions = {}
+        self.stepWait = LatencyStats()
+
+    def record(self, req, seconds, bytesSent, bytesReceived, resp):
+        """Record one request/reply exchange; req and resp as sent and decoded."""
+        name = exchangeName(req)
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = FunctionStats()
+        stats.add(seconds)
+        stats.bytesSent += bytesSent
+        stats.bytesReceived += bytesReceived
+        if isinstance(req, dict):
+            stats.calls += 1
+            stats.errors += not resp.get('success', False)
+        else:
+            stats.calls += len(req)
+            if isinstance(resp, list):
+                stats.errors += sum(not r.get('success', False) for r in resp)
+            else:
+                stats.errors += not resp.get('success', False)
+
+    def recordStepWait(self, seconds):
+        self.stepWait.add(seconds)
+
+    def snapshot(self):
+        """Plain dict of everything recorded so far, JSON serialisable."""
+        return {
+            'started': self.started,
+            'elapsed': time.time() - self.started,
+            'functions': {name: stats.snapshot() for name, stats in self.functions.items()},
+            'stepWait': self.stepWait.snapshot(),
+        }
+
+    def summary(self):
+        """Text table of the functions, the most time consuming first."""
+        functions = sorted(self.functions.items(), key=lambda item: item[1].total, reverse=True)
+        busy = sum(stats.total for _, stats in functions) + self.stepWait.total or 1.0
+        lines = [f'{"function":40s} {"count":>8s} {"total s":>9s} {"share":>6s} '
+                 + ' '.join(f'{"p" + str(p) + " ms":>9s}' for p in PERCENTILES) + f' {"sent B":>9s} {"recv B":>9s}']
+        rows = [(name, stats) for name, stats in functions] + [('(blocked in step)', self.stepWait)]
+        for name, stats in rows:
+            if not stats.count:
+                continue
+            line = f'{name[:40]:40s} {stats.count:8d} {stats.total:9.3f} {stats.total / busy:6.1%} '
+            line += ' '.join(f'{stats.percentile(p) * 1e3:9.3f}' for p in PERCENTILES)
+            if isinstance(stats, FunctionStats):
+                line += f' {stats.bytesSent // stats.count:9d} {stats.bytesReceived // stats.count:9d}'
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def dump(self, path=None):
+        """Write snapshot() as JSON to path, or the summary to stderr."""
+        if not self.functions and not self.stepWait.count:
+            return
+        if path:
+            with open(path, 'w') as f:
+                json.dump(self.snapshot(), f, indent=2)
+        else:
+            print('Remote API profile:', file=sys.stderr)
+            print(self.summary(), file=sys.stderr)
+
+
+_defaultProfiler = None
+
+
+def defaultProfiler():
+    """Profiler shared by the clients of this process, dumped at exit."""
+    global _defaultProfiler
+    if _defaultProfiler is None:
+        _defaultProfiler = CallProfiler()
+        target = os.environ.get('ZMQREMOTEAPI_PROFILE', '')
+        atexit.register(_defaultProfiler.dump, None if target in ('', '0', '1') else target)
+    return _defaultProfiler
+
+
+def getProfiler(profile=None):
+    """Return a CallProfiler from an instance, True/False, or None for $ZMQREMOTEAPI_PROFILE."""
+    if profile is None:
+        profile = os.environ.get('ZMQREMOTEAPI_PROFILE', '') not in ('', '0')
+    if profile is False:
+        return None
+    if profile is True:
+        return defaultProfiler()
+    return profile
@@ -0,0 +1,103 @@
+"""On-disk cache of zmqRemoteApi.info schemas and lazy remote object proxies."""
+
+import glob
+import json
+import os
+import tempfile
+
+# constants used to key the cache by server version, read from the sim schema
+VERSION_PARAMS = ('intparam_program_version', 'intparam_program_revision')
+
+
+def defaultCacheDir():
+    """Cache directory from $ZMQREMOTEAPI_CACHE, else ~/.cache/zmqRemoteApi."""
+    cacheDir = os.environ.get('ZMQREMOTEAPI_CACHE')
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'zmqRemoteApi')
+    return cacheDir
+
+
+class SchemaCache:
+    """Schemas stored as <cacheDir>/<name>-<version>.json."""
+
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+
+    def _path(self, name, version):
+        return os.path.join(self.cacheDir, f'{name}-{version}.json')
+
+    def load(self, name, version):
+        try:
+            with open(self._path(name, version)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def loadNewest(self, name):
+        """Most recently written schema for name, whatever its version."""
+        paths = glob.glob(os.path.join(glob.escape(self.cacheDir), f'{glob.escape(name)}-*.json'))
+        for path in sorted(paths, key=os.path.getmtime, reverse=True):
+            try:
+                with open(path) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def save(self, name, version, info):
+        """Write atomically; schemas that are not JSON serializable are not cached."""
+        try:
+            data = json.dumps(info)
+        except (TypeError, ValueError):
+            return False
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self._path(name, version))
+        except OSError:
+            return False
+        return True
+
+
+def versionCalls(simInfo):
+    """(func, args) pairs returning the server version, or None if unknown."""
+    try:
+        params = [simInfo[k]['const'] for k in VERSION_PARAMS]
+    except (KeyError, TypeError):
+        return None
+    return [('sim.getInt32Param', [param]) for param in params]
+
+
+class RemoteObject:
+    """Proxy of a remote namespace whose attributes are built on first access."""
+
+    def __init__(self, name, info, call):
+        self.__dict__['_name'] = name
+        self.__dict__['_info'] = info
+        self.__dict__['_call'] = call
+
+    def __getattr__(self, k):
+        if k.startswith('__'):
+            raise AttributeError(k)
+        try:
+            v = self._info[k]
+        except KeyError:
+            raise AttributeError(f"remote object '{self._name}' has no attribute '{k}'") from None
+        if not isinstance(v, dict):
+            raise ValueError('found nondict')
+        if len(v) == 1 and 'func' in v:
+            attr = lambda *a, func=f'{self._name}.{k}': self._call(func, a)
+        elif len(v) == 1 and 'const' in v:
+            attr = v['const']
+        else:
+            attr = RemoteObject(f'{self._name}.{k}', v, self._call)
+        self.__dict__[k] = attr
+        return attr
+
+    def __dir__(self):
+        return sorted(set(self._info) | {k for k in self.__dict__ if not k.startswith('_')})
+
+    def __repr__(self):
+        return f'<remote object {self._name}>'
@@ -0,0 +1,386 @@
+"""Local stand-in for CoppeliaSim's ZMQ Remote API server.
+
+Speaks the same CBOR REQ/REP protocol as the real server, including batched
+requests, and publishes the step counter on port+1 like the real one. It
+also implements stepUntil (see stepping.py), which CoppeliaSim's add-on does
+not have, so timings of the server-side stepping loop hold for this stand-in
+only. Replies are encoded with the codec the clients
+pick (codec.getCodec, so $ZMQREMOTEAPI_CODEC applies to both ends); with
+'cbor2-typed', float arrays such as positions go out as typed arrays. The
+scene is a plain dictionary of objects with just enough behaviour for
+Simulation (a table, a box and the blocks created by setNumberOfBlocks), so
+client and transport changes can be measured without CoppeliaSim:
+
+    python3 -m zmqRemoteApi.server --port 23000 --latency 0.0005
+
+or from Python:
+
+    server = RemoteAPIServer(port=23000, latency=0.0005)
+    server.start()
+    ...
+    server.stop()
+"""
+
+import argparse
+import math
+import threading
+import time
+
+import zmq
+
+from .codec import Cbor2Codec, getCodec
+from .stepping import signalMet
+
+CONSTS = {
+    'handle_world': -1,
+    'scripttype_childscript': 1,
+    'simulation_stopped': 0,
+    'simulation_advancing_running': 17,
+    'intparam_program_version': 1,
+    'intparam_idle_fps': 26,
+    'intparam_program_revision': 30,
+}
+VERSION = 40500
+REVISION = 0
+# steps the blocks take to "fall" before the scene raises toPython = 99
+DROP_STEPS = 10
+# stepUntil replies after this many steps even if its condition is not met
+STEP_UNTIL_LIMIT = 10000
+
+
+class RemoteAPIServer:
+    """Serve the remote API from a background thread.
+
+    latency is the artificial delay added to every reply, in seconds, or a
+    callable taking the request (a dict, or a list for batches) and returning
+    the delay.
+    """
+
+    def __init__(self, host='127.0.0.1', port=23000, cntport=None, *, latency=0.0, timeStep=0.05, verbose=False, codec=None):
+        self.host = host
+        self.port = port
+        self.cntport = cntport or port + 1
+        self.latency = latency
+        self.timeStep = timeStep
+        self.verbose = verbose
+        # replies use the clients' codec; requests are read with cbor2 when
+        # installed, since it also decodes typed arrays from any client
+        self.codec = getCodec(codec)
+        try:
+            self.decoder = self.codec if self.codec.name == 'cbor2' else Cbor2Codec()
+        except ImportError:
+            self.decoder = self.codec
+        self.typedArrays = getattr(self.codec, 'typedArrays', False)
+        self.thread = None
+        self.running = threading.Event()
+        self.requests = 0
+        self.stepCount = 0
+        self.steppingClients = set()
+        self.params = {CONSTS['intparam_idle_fps']: 8, CONSTS['intparam_program_version']: VERSION,
+                       CONSTS['intparam_program_revision']: REVISION}
+        self.resetScene()
+        self.functions = {
+            'zmqRemoteApi.info': self.info,
+            'setStepping': self.setStepping,
+            'step': self.step,
+            'stepUntil': self.stepUntil,
+        }
+        for name in dir(self):
+            if name.startswith('sim_'):
+                self.functions['sim.' + name[4:]] = getattr(self, name)
+
+    def resetScene(self):
+        self.objects = {}
+        self.paths = {}
+        self.signals = {}
+        self.simTime = 0.0
+        self.state = CONSTS['simulation_stopped']
+        self.scripts = {}
+        self.pendingDrop = None
+        self.addObject('/Table', [0.0, 0.0, 0.0])
+        self.addObject('/Table/Box', [0.0, 0.0, 0.1])
+
+    def addObject(self, path, position):
+        handle = len(self.objects) + 1
+        self.objects[handle] = {'position': list(position), 'quaternion': [0.0, 0.0, 0.0, 1.0]}
+        self.paths[path] = handle
+        return handle
+
+    # --- transport ---
+
+    def start(self):
+        """Bind the sockets and serve requests from a daemon thread."""
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.REP)
+        self.socket.bind(f'tcp://{self.host}:{self.port}')
+        self.cntsocket = self.context.socket(zmq.PUB)
+        self.cntsocket.bind(f'tcp://{self.host}:{self.cntport}')
+        self.running.set()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.socket.close(linger=0)
+        self.cntsocket.close(linger=0)
+        self.context.term()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *excinfo):
+        self.stop()
+
+    def _serve(self):
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        while self.running.is_set():
+            if not poller.poll(50):
+                continue
+            req = self.decoder.loads(self.socket.recv())
+            if self.verbose:
+                print('Server received:', req)
+            if isinstance(req, list):
+                resp = [self.handle(r) for r in req]
+            else:
+                resp = self.handle(req)
+            delay = self.latency(req) if callable(self.latency) else self.latency
+            if delay:
+                time.sleep(delay)
+            self.socket.send(self.codec.dumps(resp))
+
+    def handle(self, req):
+        self.requests += 1
+        try:
+            func = req['func']
+            if func not in self.functions:
+                raise KeyError(f'unknown function {func}')
+            ret = self.functions[func](*req.get('args', []))
+            if not isinstance(ret, tuple):
+                ret = () if ret is None else (ret,)
+            if self.typedArrays:
+                ret = tuple(self.typedArray(value) for value in ret)
+            return {'success': True, 'ret': list(ret)}
+        except Exception as e:
+            return {'success': False, 'error': f'{type(e).__name__}: {e}'}
+
+    def typedArray(self, value):
+        # float lists, e.g. positions, are sent as one typed array
+        if isinstance(value, list) and value and all(isinstance(v, float) for v in value):
+            import numpy as np
+            return np.array(value)
+        return value
+
+    # --- protocol level functions ---
+
+    def info(self, name):
+        if name != 'sim':
+            raise KeyError(f'unknown namespace {name}')
+        info = {k[len('sim.'):]: {'func': ''} for k in self.functions if k.startswith('sim.')}
+        info.update({k: {'const': v} for k, v in CONSTS.items()})
+        return info
+
+    def setStepping(self, enable, uuid):
+        if enable:
+            self.steppingClients.add(uuid)
+        else:
+            self.steppingClients.discard(uuid)
+        return 0
+
+    def step(self, uuid=None):
+        self.advance(1)
+
+    def stepUntil(self, uuid, until):
+        start = self.simTime
+        limit = STEP_UNTIL_LIMIT if until['maxSteps'] is None else min(until['maxSteps'], STEP_UNTIL_LIMIT)
+        steps = 0
+        met = False
+        current = None
+        while True:
+            if steps >= until['minSteps']:
+                if until['signal'] is not None:
+                    current = self.signalValue(until['signal'], until['signalType'])
+                    met = signalMet(until, current)
+                if not met and until['simTime'] is not None:
+                    met = self.simTime - start >= until['simTime'] - 1e-9
+                if met or steps >= limit:
+                    break
+            self.tick()
+            steps += 1
+        if met:
+            for _ in range(until['extraSteps']):
+                self.tick()
+                steps += 1
+        if steps:
+            self.cntsocket.send(self.codec.dumps(self.stepCount))
+        return {'steps': steps, 'met': met, 'value': current, 'simTime': self.simTime, 'timeStep': self.timeStep}
+
+    def signalValue(self, name, signalType):
+        value = self.signals.get(name)
+        if signalType is None or value is None:
+            return value
+        if signalType == 'string':
+            return value if isinstance(value, str) else None
+        if isinstance(value, str):
+            return None
+        return int(value) if signalType == 'int32' else float(value)
+
+    def advance(self, steps):
+        for _ in range(steps):
+            self.tick()
+        self.cntsocket.send(self.codec.dumps(self.stepCount))
+
+    def tick(self):
+        self.stepCount += 1
+        if self.state != CONSTS['simulation_stopped']:
+            self.simTime += self.timeStep
+            if self.pendingDrop is not None:
+                self.pendingDrop -= 1
+                if self.pendingDrop <= 0:
+                    self.signals['toPython'] = 99.0
+                    self.pendingDrop = None
+
+    # --- sim.* functions ---
+
+    def sim_getInt32Param(self, param):
+        return self.params.get(param, 0)
+
+    def sim_setInt32Param(self, param, value):
+        self.params[param] = value
+
+    def sim_getObject(self, path, options=None):
+        if path not in self.paths:
+            raise KeyError(f'object does not exist: {path}')
+        return self.paths[path]
+
+    def sim_getObjectHandle(self, name):
+        for path, handle in self.paths.items():
+            if path.rsplit('/', 1)[-1] == name:
+                return handle
+        raise KeyError(f'object does not exist: {name}')
+
+    def sim_getObjectPosition(self, handle, relativeTo):
+        return list(self.objects[handle]['position'])
+
+    def sim_setObjectPosition(self, handle, relativeTo, position):
+        # typed arrays arrive as NumPy arrays
+        self.objects[handle]['position'] = [float(v) for v in position]
+
+    def sim_getObjectQuaternion(self, handle, relativeTo):
+        return list(self.objects[handle]['quaternion'])
+
+    def sim_setObjectQuaternion(self, handle, relativeTo, quaternion):
+        self.objects[handle]['quaternion'] = [float(v) for v in quaternion]
+
+    def sim_resetDynamicObject(self, handle):
+        if handle not in self.objects:
+            raise KeyError(f'invalid handle {handle}')
+
+    def sim_startSimulation(self):
+        self.state = CONSTS['simulation_advancing_running']
+
+    def sim_stopSimulation(self):
+        # like the real simulator, objects created while running are removed
+        self.resetScene()
+
+    def sim_getSimulationState(self):
+        return self.state
+
+    def sim_getSimulationTime(self):
+        return self.simTime
+
+    def sim_getSimulationTimeStep(self):
+        return self.timeStep
+
+    def sim_getSystemTimeInMs(self, previousTime):
+        now = int(time.monotonic() * 1000)
+        return now if previousTime < 0 else now - previousTime
+
+    def sim_getScript(self, scriptType, objectHandle):
+        self.scripts.setdefault(objectHandle, set())
+        return 1000 + objectHandle
+
+    def sim_executeScriptString(self, code, scriptHandle):
+        # only function definitions matter to the stand-in
+        for line in code.splitlines():
+            if line.startswith('function '):
+                self.scripts.setdefault(scriptHandle - 1000, set()).add(line[len('function '):].split('(')[0])
+        return 0, None
+
+    def sim_callScriptFunction(self, name, scriptHandle, inInts=(), inFloats=(), inStrings=(), inBuffer=b''):
+        if name == 'setNumberOfBlocks':
+            return self.setNumberOfBlocks(inInts, inFloats)
+        if name == 'envStep' and name in self.scripts.get(scriptHandle - 1000, ()):
+            return self.envStep(inInts, inFloats)
+        raise KeyError(f'script function {name} does not exist')
+
+    def sim_getInt32Signal(self, name):
+        return self.signalValue(name, 'int32')
+
+    def sim_getFloatSignal(self, name):
+        return self.signalValue(name, 'float')
+
+    def sim_getDoubleSignal(self, name):
+        return self.signalValue(name, 'double')
+
+    def sim_getStringSignal(self, name):
+        return self.signalValue(name, 'string')
+
+    def sim_setFloatSignal(self, name, value):
+        self.signals[name] = float(value)
+
+    def sim_clearFloatSignal(self, name):
+        self.signals.pop(name, None)
+
+    # --- scene script functions ---
+
+    def setNumberOfBlocks(self, inInts, inFloats):
+        blocks = inInts[0]
+        blockLength = inFloats[1] if len(inFloats) > 1 else 0.016
+        # lay the blocks out on a grid around the box, colour by colour
+        side = math.ceil(math.sqrt(blocks))
+        for i in range(blocks):
+            x = ((i % side) - (side - 1) / 2) * blockLength * 1.2
+            y = ((i // side) - (side - 1) / 2) * blockLength * 1.2
+            self.addObject(f'/Cylinder{i}', [x, y, 0.1])
+        self.signals.pop('toPython', None)
+        self.pendingDrop = DROP_STEPS
+        return [], [], []
+
+    def envStep(self, inInts, inFloats):
+        axis, boxHandle, blockHandles = inInts[0], inInts[1], inInts[2:]
+        span, steps, strokes = inFloats[0], int(inFloats[1]), inFloats[2:]
+        position = self.objects[boxHandle]['position']
+        for stroke in strokes:
+            for _ in range(steps):
+                position[axis] += stroke * span / steps
+        out = list(position)
+        for handle in blockHandles:
+            out.extend(self.objects[handle]['position'])
+        # same four values as envStep.lua
+        return [], out, [], ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=23000)
+    parser.add_argument('--latency', type=float, default=0.0, help='delay added to every reply, in seconds')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--codec', help='cbor, cbor2, cbor2-typed or auto, default $ZMQREMOTEAPI_CODEC')
+    args = parser.parse_args()
+    server = RemoteAPIServer(args.host, args.port, latency=args.latency, verbose=args.verbose, codec=args.codec).start()
+    print(f'Serving on tcp://{args.host}:{args.port} (step counter on {server.cntport})')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Step-until conditions shared by the clients and the stand-in server.
+
+A condition is sent as a dict with the keys of untilCondition(). The server
+steps until the condition is met, or up to its own per request step limit,
+and replies with {'steps', 'met', 'value', 'simTime', 'timeStep'}.
+
+Only the stand-in server in server.py implements stepUntil; CoppeliaSim's
+ZMQ Remote API add-on has no such function. Against it, the clients learn
+this from the first "unknown function" reply and drive the loop step by
+step from the client, one round trip per step as before.
+"""
+
+import math
+
+# signal getters by signalType, the order _waitForSignal checked them in
+SIGNAL_GETTERS = {
+    'int32': 'sim.getInt32Signal',
+    'float': 'sim.getFloatSignal',
+    'double': 'sim.getDoubleSignal',
+    'string': 'sim.getStringSignal',
+}
+
+
+def untilCondition(signal=None, value=None, signalType=None, simTime=None, maxSteps=None, minSteps=0, extraSteps=0):
+    """Validate the arguments of stepUntil and return them as a condition dict."""
+    if signal is None and simTime is None and maxSteps is None:
+        raise ValueError('stepUntil needs a signal, simTime or maxSteps')
+    if signalType is not None and signalType not in SIGNAL_GETTERS:
+        raise ValueError(f'unknown signalType {signalType!r}, expected one of {sorted(SIGNAL_GETTERS)}')
+    return {'signal': signal, 'value': value, 'signalType': signalType, 'simTime': simTime,
+            'maxSteps': maxSteps, 'minSteps': minSteps, 'extraSteps': extraSteps}
+
+
+# phrases of an error reply saying the server has no such function
+UNKNOWN_FUNCTION_ERRORS = ('unknown function', 'no such function', 'not found', 'does not exist',
+                           'attempt to call a nil value')
+
+
+def unknownFunction(error, func):
+    """Whether a failed call of func failed because the server does not know it."""
+    if isinstance(error, (TimeoutError, OSError)):
+        return False
+    text = str(error).lower()
+    return any(phrase in text for phrase in UNKNOWN_FUNCTION_ERRORS) and (
+        func.lower() in text or 'nil value' in text)
+
+
+def signalGetters(until):
+    return [SIGNAL_GETTERS[until['signalType']]] if until['signalType'] else list(SIGNAL_GETTERS.values())
+
+
+def signalValue(values):
+    """First value that is set, from the replies of signalGetters."""
+    return next((v for v in values if v is not None), None)
+
+
+def signalMet(until, current):
+    if current is None:
+        return False
+    return until['value'] is None or current == until['value']
+
+
+def stepsFor(simTime, timeStep):
+    """Steps needed for simTime seconds to pass, as in 'while elapsed < simTime: step'."""
+    return max(0, math.ceil(simTime / timeStep - 1e-9))
+
+
+def remainingCondition(until, result):
+    """The condition left after the server stopped at its step limit without meeting it."""
+    steps = result['steps']
+    remaining = dict(until, minSteps=max(0, until['minSteps'] - steps))
+    if until['maxSteps'] is not None:
+        remaining['maxSteps'] = until['maxSteps'] - steps
+    if until['simTime'] is not None:
+        remaining['simTime'] = until['simTime'] - steps * result['timeStep']
+    return remaining
+
+
+def finished(until, result):
+    return result['met'] or (until['maxSteps'] is not None and result['steps'] >= until['maxSteps'])